@@ -0,0 +1,250 @@
+import hashlib
+import os
+import random
+import re
+import zlib
+from importlib import metadata
+from pathlib import Path
+
+# UniOIE的规则只需要每个词的 id, text, upos, xpos, head, deprel
+PROCESSORS = 'tokenize,mwt,pos,lemma,depparse'
+
+# 可以选择的解析配置, 传给StanzaParser
+# depparse的输入里有lemma, stanza也要求depparse之前有lemma, 所以只能让lemma只查词典, 不跑seq2seq模型
+PROFILES = {
+    'default': dict(processors=PROCESSORS, use_gpu=True),
+    'cpu-fast': dict(processors=PROCESSORS, use_gpu=False, lemma_dict_only=True, threads=os.cpu_count()),
+    # pos/depparse的LSTM和Linear层做int8动态量化, 结果可能与float模型略有不同
+    'cpu-int8': dict(processors=PROCESSORS, use_gpu=False, lemma_dict_only=True, threads=os.cpu_count(), quantize=True),
+}
+
+# 只影响在哪里/怎么运行, 不影响解析结果的pipeline参数, 不计入缓存的fingerprint
+RUNTIME_OPTIONS = {'use_gpu', 'device', 'logging_level', 'download_method'}
+
+# 每个进程里按配置缓存stanza pipeline, 只在第一次parse时加载模型
+_pipelines = {}
+
+
+class StanzaParser:
+
+    def __init__(self, processors=PROCESSORS, use_gpu=True, threads=None, quantize=False, **kwargs):
+        # threads: torch的intra-op线程数, None为torch的默认值
+        # quantize: 对pos/depparse模型做int8动态量化
+        self.config = dict(
+            lang='en', processors=processors, logging_level='ERROR',
+            use_gpu=use_gpu, download_method=None, **kwargs,
+        )
+        self.threads, self.quantize = threads, quantize
+
+    @property
+    def fingerprint(self):
+        # 解析结果由 processors配置 + stanza版本 + 模型文件 决定, 串行(use_gpu=True)和并行(use_gpu=False)共用缓存
+        config = sorted((key, value) for key, value in self.config.items() if key not in RUNTIME_OPTIONS)
+        try:
+            version = metadata.version('stanza')
+        except metadata.PackageNotFoundError:
+            version = ''
+        model_dir = Path(self.config.get('dir') or os.environ.get('STANZA_RESOURCES_DIR', '~/stanza_resources')).expanduser()
+        resources = model_dir / 'resources.json'
+        models = hashlib.sha256(resources.read_bytes()).hexdigest() if resources.exists() else ''
+
+        if self.quantize:
+            return repr((config, 'qint8', version, models))
+        return repr((config, version, models))
+
+    @property
+    def pipeline(self):
+        key = (tuple(sorted(self.config.items())), self.quantize)
+        if key not in _pipelines:
+            import stanza
+            if self.threads:
+                import torch
+                torch.set_num_threads(self.threads)
+            _pipelines[key] = stanza.Pipeline(**self.config)
+            if self.quantize:
+                _quantize(_pipelines[key])
+        return _pipelines[key]
+
+    def parse(self, sentence):
+        return self.pipeline(sentence).sentences[0].to_dict()
+
+    def parse_batch(self, sentences):
+        import stanza
+        # bulk_process对整批句子逐个processor批量计算, 但每行仍然保留自己的分句结果
+        documents = self.pipeline.bulk_process([stanza.Document([], text=sentence) for sentence in sentences])
+        return [document.sentences[0].to_dict() for document in documents]
+
+
+def _quantize(pipeline, processors=('pos', 'depparse')):
+    import torch
+
+    for name in processors:
+        processor = pipeline.processors.get(name)
+        trainer = processor and (getattr(processor, '_trainer', None) or getattr(processor, 'trainer', None))
+        if trainer is None:
+            continue
+        trainer.model = torch.quantization.quantize_dynamic(
+            trainer.model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8,
+        )
+
+
+# 粗略估计stanza切出的词数: 单词和单个标点各算一个
+TOKENS = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(sentence):
+    return len(TOKENS.findall(sentence)) or 1
+
+
+class BucketedParser:
+    """包在解析后端外面, 按估计的词数把句子分组后再批量解析
+
+    同一批的句子长度相近, 每批的 最长句子词数 x 句子数 不超过token_budget,
+    pad到最长句子时浪费的计算少, 遇到很长的句子时内存也稳定; 返回的结果保持输入顺序
+    """
+
+    def __init__(self, parser, token_budget=4096, max_batch=256):
+        self.parser = parser
+        self.token_budget, self.max_batch = token_budget, max_batch
+        self.fingerprint = getattr(parser, 'fingerprint', type(parser).__name__)
+        # tokens / padded_tokens 就是pad之后有效计算的比例
+        self.batches = self.tokens = self.padded_tokens = 0
+
+    def parse(self, sentence):
+        return self.parser.parse(sentence)
+
+    def schedule(self, sentences):
+        """[[句子在输入中的位置, ...], ...], 按长度从短到长"""
+        lengths = [estimate_tokens(sentence) for sentence in sentences]
+
+        batches, batch = [], []
+        for position in sorted(range(len(sentences)), key=lengths.__getitem__):
+            # 按长度升序, 新加入的句子就是这一批最长的
+            if batch and (lengths[position] * (len(batch) + 1) > self.token_budget or len(batch) >= self.max_batch):
+                batches.append(batch)
+                batch = []
+            batch.append(position)
+        if batch:
+            batches.append(batch)
+
+        for batch in batches:
+            self.batches += 1
+            self.tokens += sum(lengths[position] for position in batch)
+            self.padded_tokens += lengths[batch[-1]] * len(batch)
+        return batches
+
+    def parse_batch(self, sentences):
+        parsed = [None] * len(sentences)
+        for batch in self.schedule(sentences):
+            for position, words in zip(batch, self.parser.parse_batch([sentences[position] for position in batch])):
+                parsed[position] = words
+        return parsed
+
+
+class PreParsedParser:
+    """已经解析好的句子, sentence -> Sentence.to_dict() 格式的词列表"""
+
+    def __init__(self, parsed):
+        self.parsed = dict(parsed)
+
+    def parse(self, sentence):
+        return self.parsed[sentence]
+
+    def parse_batch(self, sentences):
+        return [self.parse(sentence) for sentence in sentences]
+
+
+class StubParser:
+    """不加载模型的解析器, 按空格切词并生成确定的随机依存树, 用于benchmark和测试"""
+
+    DEPRELS = [
+        'nsubj', 'obj', 'iobj', 'obl', 'case', 'mark', 'det', 'amod', 'nummod', 'compound', 'nmod',
+        'advmod', 'aux', 'cop', 'conj', 'cc', 'acl', 'advcl', 'xcomp', 'ccomp', 'appos',
+    ]
+    fingerprint = 'stub'
+
+    def parse(self, sentence):
+        # 同一个句子总是得到同一棵树
+        rng = random.Random(zlib.crc32(sentence.encode('utf-8')))
+        words = sentence.split() or ['']
+
+        order = list(range(1, len(words) + 1))
+        rng.shuffle(order)
+        heads = {order[0]: 0}
+        for position, index in enumerate(order[1:], 1):
+            heads[index] = order[rng.randrange(position)]
+
+        parsed = []
+        for index, word in enumerate(words, 1):
+            punct = not any(char.isalnum() for char in word)
+            if heads[index] == 0:
+                deprel = 'root'
+            else:
+                deprel = 'punct' if punct else rng.choice(self.DEPRELS)
+            parsed.append({
+                'id': index, 'text': word, 'upos': 'PUNCT' if punct else 'NOUN', 'xpos': 'NN',
+                'head': heads[index], 'deprel': deprel,
+            })
+        return parsed
+
+    def parse_batch(self, sentences):
+        return [self.parse(sentence) for sentence in sentences]
+
+
+def from_conllu(text):
+    sentences, words = [], []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            if words:
+                sentences.append(words)
+            words = []
+            continue
+        if line.startswith('#'):
+            continue
+
+        columns = line.split('\t')
+        # 跳过多词token(1-2)和空节点(1.1), 与to_dict()中的词保持一致
+        if not columns[0].isdigit():
+            continue
+        words.append({
+            'id': int(columns[0]),
+            'text': columns[1],
+            'lemma': columns[2],
+            'upos': columns[3],
+            'xpos': columns[4],
+            'head': int(columns[6]),
+            'deprel': columns[7],
+        })
+
+    if words:
+        sentences.append(words)
+
+    return sentences
+
+
+def load_conllu(conllu_file):
+    # 以 "# text = ..." 注释作为句子的key
+    parsed = {}
+    for block in Path(conllu_file).read_text().split('\n\n'):
+        texts = [line[len('# text = '):] for line in block.split('\n') if line.startswith('# text = ')]
+        words = from_conllu(block)
+        if texts and words:
+            parsed[texts[0]] = words[0]
+
+    return PreParsedParser(parsed)
+
+
+_default_parser = None
+
+def default_parser():
+    global _default_parser
+    if _default_parser is None:
+        _default_parser = StanzaParser()
+    return _default_parser
+
+
+def profile_parser(profile=None):
+    if profile is None or profile == 'default':
+        return default_parser()
+    return StanzaParser(**PROFILES[profile])
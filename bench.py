@@ -0,0 +1,236 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+import eval
+from backend import StanzaParser, StubParser, profile_parser
+from cache import FIELDS
+from main import DepTree
+from relation import dumps
+
+# 分阶段的性能测试: 解析, 建树, 规则遍历, 序列化, 以及eval的flatten和打分
+# 结果写成json, 可以与保存的baseline对比, 吞吐下降超过阈值时返回非0
+
+ROOT = Path(__file__).parent
+STAGES = ['parse', 'construct', 'walk', 'serialize', 'flatten', 'score']
+
+
+def load_corpora(size=100, synthetic_tokens=150):
+    lines = (ROOT / 'all.txt').read_text().split('\n')
+    # all.txt: 前302行是dev的长句, 之后是hotpotqa/squad/strategyqa的短问句
+    corpora = {
+        'sentence': list(enumerate(lines[:302], 1))[:size],
+        'question': list(enumerate(lines[302:], 303))[:size],
+    }
+
+    # 把dev的句子用并列连接成很长的句子, 测试规则遍历的最坏情况
+    synthetic, current = [], []
+    for line in lines[:302]:
+        current.append(line.rstrip(' .'))
+        if sum(len(part.split()) for part in current) >= synthetic_tokens:
+            synthetic.append((None, ' , and '.join(current) + ' .'))
+            current = []
+        if len(synthetic) >= max(1, size // 10):
+            break
+    corpora['synthetic'] = synthetic
+
+    return corpora
+
+
+class Timer:
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.items = {stage: 0 for stage in STAGES}
+
+    def time(self, stage, function, *args, items=1):
+        start = time.perf_counter()
+        result = function(*args)
+        self.samples[stage].append(time.perf_counter() - start)
+        self.items[stage] += items
+        return result
+
+    def report(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            total = sum(samples)
+            report[stage] = {
+                'calls': len(samples),
+                'items': self.items[stage],
+                'seconds': total,
+                'throughput': self.items[stage] / total if total else float('inf'),
+                'p50_ms': _percentile(ordered, 50) * 1000,
+                'p90_ms': _percentile(ordered, 90) * 1000,
+                'p99_ms': _percentile(ordered, 99) * 1000,
+            }
+        return report
+
+
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def bench_corpus(corpus, parser, annotations, repeat=1, batch_size=32):
+    timer = Timer()
+    sentences = [sentence for _, sentence in corpus]
+
+    for _ in range(repeat):
+        parsed = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            parsed += timer.time('parse', parser.parse_batch, batch, items=len(batch))
+
+        for (index, sentence), words in zip(corpus, parsed):
+            # 不经过__init__, 分别计时各个阶段
+            tree = DepTree.__new__(DepTree)
+            timer.time('construct', lambda: (tree._construct_word_list(words), tree._construct_dependency_tree(words)))
+            relation = timer.time('walk', tree._extract_uniOIE)
+            # 与main.py里JsonlWriter.write用的序列化相同
+            timer.time('serialize', lambda: dumps(relation, ensure_ascii=False))
+
+            predicted = timer.time('flatten', eval.triplet_texts, relation)
+            if index in annotations:
+                gold = eval.triplet_texts(annotations[index][1])
+                timer.time('score', eval.evaluate_token, gold, predicted)
+
+    return timer.report()
+
+
+def run(size=100, repeat=1, stub=False, batch_size=32):
+    parser = StubParser() if stub else StanzaParser()
+    annotations = eval.load_annotations()
+
+    results = {
+        'config': {
+            'size': size, 'repeat': repeat, 'stub': stub, 'batch_size': batch_size,
+            'python': sys.version.split()[0], 'machine': platform.machine(),
+        },
+        'corpora': {},
+    }
+    for name, corpus in load_corpora(size).items():
+        results['corpora'][name] = bench_corpus(corpus, parser, annotations, repeat, batch_size)
+
+    return results
+
+
+def compare_profiles(profile, baseline='default', size=100, repeat=1, batch_size=32):
+    """profile相对baseline的解析加速比, 以及解析结果(规则用到的字段)/抽取结果不同的句子"""
+    import torch
+
+    # torch.set_num_threads对整个进程生效, 两个pipeline加载后线程数是最后加载的那个的,
+    # 每个profile计时前设回它自己的线程数, threads为None的用加载前torch的默认值
+    default_threads = torch.get_num_threads()
+    parsers = {baseline: profile_parser(baseline), profile: profile_parser(profile)}
+    # 加载模型的时间不计入
+    for parser in parsers.values():
+        parser.parse_batch(['UniOIE is ready.'])
+
+    try:
+        return _compare_profiles(parsers, baseline, profile, default_threads, size, repeat, batch_size)
+    finally:
+        torch.set_num_threads(default_threads)
+
+
+def _compare_profiles(parsers, baseline, profile, default_threads, size, repeat, batch_size):
+    import torch
+
+    report = {'baseline': baseline, 'profile': profile, 'corpora': {}}
+    for name, corpus in load_corpora(size).items():
+        sentences = [sentence for _, sentence in corpus]
+        seconds, parsed = {}, {}
+        for label, parser in parsers.items():
+            torch.set_num_threads(getattr(parser, 'threads', None) or default_threads)
+            timer = Timer()
+            for _ in range(repeat):
+                parsed[label] = []
+                for start in range(0, len(sentences), batch_size):
+                    batch = sentences[start:start + batch_size]
+                    parsed[label] += timer.time('parse', parser.parse_batch, batch, items=len(batch))
+            seconds[label] = timer.report()['parse']['seconds']
+
+        parse_diffs, relation_diffs = 0, []
+        for sentence, expected, words in zip(sentences, parsed[baseline], parsed[profile]):
+            if [[word[field] for field in FIELDS] for word in expected] == [[word[field] for field in FIELDS] for word in words]:
+                continue
+            parse_diffs += 1
+            if DepTree(sentence, expected).relation != DepTree(sentence, words).relation:
+                relation_diffs.append(sentence)
+
+        report['corpora'][name] = {
+            'sentences': len(sentences),
+            'baseline_seconds': seconds[baseline],
+            'profile_seconds': seconds[profile],
+            'speedup': seconds[baseline] / seconds[profile] if seconds[profile] else float('inf'),
+            'parse_diffs': parse_diffs,
+            'relation_diffs': relation_diffs,
+        }
+
+    return report
+
+
+def print_profile_report(report):
+    print(f'============= {report["profile"]} vs {report["baseline"]}')
+    print(f'{"corpus":<10} {"speedup":>8} {"parse diffs":>12} {"relation diffs":>15}')
+    for name, stats in report['corpora'].items():
+        print(f'{name:<10} {stats["speedup"]:>7.2f}x {stats["parse_diffs"]:>12} {len(stats["relation_diffs"]):>15}')
+    for name, stats in report['corpora'].items():
+        for sentence in stats['relation_diffs']:
+            print(f'DIFF {name}: {sentence}')
+
+
+def compare(results, baseline, tolerance=0.2):
+    """吞吐比baseline下降超过tolerance的阶段"""
+    regressions = []
+    for name, stages in results['corpora'].items():
+        for stage, current in stages.items():
+            previous = baseline['corpora'].get(name, {}).get(stage)
+            if previous is None:
+                continue
+            change = current['throughput'] / previous['throughput'] - 1
+            if change < -tolerance:
+                regressions.append((name, stage, previous['throughput'], current['throughput'], change))
+    return regressions
+
+
+def print_report(results):
+    for name, stages in results['corpora'].items():
+        print(f'============= {name}')
+        print(f'{"stage":<10} {"items/s":>12} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10}')
+        for stage, stats in stages.items():
+            print(f'{stage:<10} {stats["throughput"]:>12.1f} {stats["p50_ms"]:>10.3f} {stats["p90_ms"]:>10.3f} {stats["p99_ms"]:>10.3f}')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--size', type=int, default=100, help='每个语料取的句子数')
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--batch-size', type=int, default=32)
+    arg_parser.add_argument('--stub', action='store_true', help='用StubParser, 不需要模型文件')
+    arg_parser.add_argument('--output', default='bench_results.json')
+    arg_parser.add_argument('--baseline', default=None, help='与保存的结果对比')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2)
+    arg_parser.add_argument('--profile', default=None, help='与default解析配置对比速度和输出, 见backend.PROFILES')
+    args = arg_parser.parse_args()
+
+    if args.profile:
+        report = compare_profiles(args.profile, size=args.size, repeat=args.repeat, batch_size=args.batch_size)
+        print_profile_report(report)
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        sys.exit()
+
+    results = run(args.size, args.repeat, args.stub, args.batch_size)
+    print_report(results)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for name, stage, previous, current, change in regressions:
+            print(f'REGRESSION {name}/{stage}: {previous:.1f} -> {current:.1f} items/s ({change:+.0%})')
+        if regressions:
+            sys.exit(1)
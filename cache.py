@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+# 只保存规则用到的字段, 比完整的to_dict()小很多
+FIELDS = ['id', 'text', 'upos', 'xpos', 'head', 'deprel']
+
+
+def compact(parsed):
+    return zlib.compress(json.dumps(
+        [[word[field] for field in FIELDS] for word in parsed],
+        ensure_ascii=False, separators=(',', ':'),
+    ).encode())
+
+
+def expand(data):
+    return [dict(zip(FIELDS, word)) for word in json.loads(zlib.decompress(data))]
+
+
+class ParseCache:
+    """sqlite上的解析缓存, key = hash(句子 + 解析器配置), 多进程可以同时读写"""
+
+    def __init__(self, path='.cache/parse.sqlite', max_bytes=256 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._connection, self._pid = None, None
+
+    @property
+    def connection(self):
+        # sqlite连接不能跨fork使用, 每个进程各自打开
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS parses '
+                '(key TEXT PRIMARY KEY, data BLOB, size INTEGER, accessed REAL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS parses_accessed ON parses (accessed)')
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def key(sentence, fingerprint):
+        return hashlib.sha256(json.dumps([sentence, fingerprint]).encode()).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f'SELECT key, data FROM parses WHERE key IN ({",".join("?" * len(chunk))})', chunk,
+            ).fetchall()
+            found.update((key, expand(data)) for key, data in rows)
+
+        if found:
+            now = time.time()
+            self.connection.executemany('UPDATE parses SET accessed = ? WHERE key = ?', [(now, key) for key in found])
+
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, parsed in items:
+            data = compact(parsed)
+            rows.append((key, data, len(data), now))
+
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.executemany('INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?)', rows)
+            self._evict()
+
+    def _evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM parses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # 按最近访问时间淘汰, 腾到上限的90%
+        excess = total - int(self.max_bytes * 0.9)
+        evicted = []
+        for key, size in self.connection.execute('SELECT key, size FROM parses ORDER BY accessed'):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        self.connection.executemany('DELETE FROM parses WHERE key = ?', evicted)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM parses')
+
+
+class CachedParser:
+    """包在任意解析后端外面, 只有缓存里没有的句子才真正去解析"""
+
+    def __init__(self, parser, cache):
+        self.parser, self.cache = parser, cache
+        self.fingerprint = getattr(parser, 'fingerprint', type(parser).__name__)
+        self.hits = self.misses = 0
+
+    def parse(self, sentence):
+        return self.parse_batch([sentence])[0]
+
+    def parse_batch(self, sentences):
+        keys = [self.cache.key(sentence, self.fingerprint) for sentence in sentences]
+        found = self.cache.get_many(set(keys))
+
+        missing = list({key: sentence for key, sentence in zip(keys, sentences) if key not in found}.items())
+        if missing:
+            parsed = self.parser.parse_batch([sentence for _, sentence in missing])
+            self.cache.put_many((key, words) for (key, _), words in zip(missing, parsed))
+            found.update((key, expand(compact(words))) for (key, _), words in zip(missing, parsed))
+
+        self.hits += len(sentences) - len(missing)
+        self.misses += len(missing)
+
+        return [found[key] for key in keys]
@@ -4,9 +4,32 @@ from pathlib import Path
 from tqdm import tqdm
 
 # Graphene
+GRAPHENE_URL = "http://localhost:8080/relationExtraction/text"
+
+
+def _graphene_request(sentence):
+    return {
+        "text": sentence,
+        "doCoreference": "false",
+        "isolateSentences": "false",
+        "format": "DEFAULT"
+    }
+
+
+def _graphene_relations(response):
+    relations = []
+    for relation in response['sentences'][0]['extractionMap'].values():
+        relations.append([
+            relation['arg1'],
+            relation['relation'],
+            relation['arg2'],
+        ])
+    return relations
+
+
 def graphene(sentences):
     # 定义请求的 URL
-    url = "http://localhost:8080/relationExtraction/text"
+    url = GRAPHENE_URL
 
     # 定义请求头
     headers = {
@@ -16,87 +39,74 @@ def graphene(sentences):
 
     all_relations = {}
     for index, sentence in tqdm(enumerate(sentences, 1), desc='graphene'):
-        # 定义请求体
-        data = {
-            "text": sentence,
-            "doCoreference": "false",
-            "isolateSentences": "false",
-            "format": "DEFAULT"
-        }
-
         # 发送 POST 请求
-        response = requests.post(url, headers=headers, json=data)
-
-        relations = []
-        for relation in json.loads(response.text)['sentences'][0]['extractionMap'].values():
-            relations.append([
-                relation['arg1'],
-                relation['relation'],
-                relation['arg2'],
-            ])
+        response = requests.post(url, headers=headers, json=_graphene_request(sentence))
 
-        all_relations[index] = relations
+        all_relations[index] = _graphene_relations(json.loads(response.text))
 
     return all_relations
 
 
-def stanford(sentences):
-    from openie import StanfordOpenIE
-    properties = {
-        'openie.affinity_probability_cap': 2 / 3,
-    }
-
-    all_relations = {i: [] for i in range(1, 603)}
-    with StanfordOpenIE(properties=properties, install_dir_path='../stanfordOIE') as client:
-        for index, sentence in tqdm(enumerate(sentences, 1), desc='stanford'):
-            relations = []
-            for relation in client.annotate(sentence):
-                relations.append([
-                    relation['subject'],
-                    relation['relation'],
-                    relation['object'],
+def graphene_async(sentences, url=GRAPHENE_URL, concurrency=16, retries=3, backoff=0.5, timeout=60):
+    """并发请求Graphene, 共用一个连接池, 同时最多concurrency个请求, 失败后指数退避重试"""
+    import asyncio
+    import aiohttp
+
+    async def _extract(session, semaphore, progress, sentence):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    async with session.post(url, json=_graphene_request(sentence)) as response:
+                        response.raise_for_status()
+                        relations = _graphene_relations(await response.json(content_type=None))
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if attempt == retries:
+                        raise
+                    await asyncio.sleep(backoff * 2 ** attempt)
+        progress.update()
+        return relations
+
+    async def _run():
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        async with aiohttp.ClientSession(
+            connector=connector, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as session:
+            semaphore = asyncio.Semaphore(concurrency)
+            with tqdm(total=len(sentences), desc='graphene') as progress:
+                return await asyncio.gather(*[
+                    _extract(session, semaphore, progress, sentence) for sentence in sentences
                 ])
 
-            all_relations[index] = relations
+    sentences = list(sentences)
+    # gather按输入顺序返回, 结果按句子index存放
+    return dict(enumerate(asyncio.run(_run()), 1))
 
-    return all_relations
-
-
-def clausie():
-    pass
 
+def stanford(sentences):
+    from jvm_worker import JVMClient
 
-def minie(sentences):
-    import os
-    from pathlib import Path
-    os.environ['CLASSPATH'] = '/home/lee/openIE/LinkingConcepts/zoo/minie/miniepy/target/minie-0.0.1-SNAPSHOT.jar'
+    # JVM在常驻的worker进程里, 这里只发送句子
+    sentences = list(sentences)
+    with JVMClient() as client, tqdm(total=len(sentences), desc='stanford') as progress:
+        relations = client.extract('stanford', sentences, progress=progress)
 
-    from jnius import autoclass
+    return dict(enumerate(relations, 1))
 
-    CoreNLPUtils = autoclass('de.uni_mannheim.utils.coreNLP.CoreNLPUtils')
-    AnnotatedProposition = autoclass('de.uni_mannheim.minie.annotation.AnnotatedProposition')
-    MinIE = autoclass('de.uni_mannheim.minie.MinIE')
-    StanfordCoreNLP = autoclass('edu.stanford.nlp.pipeline.StanfordCoreNLP')
-    String = autoclass('java.lang.String')
 
-    parser = CoreNLPUtils.StanfordDepNNParser()
+def clausie():
+    pass
 
-    MinIEMode = autoclass('de.uni_mannheim.minie.MinIE$Mode')
-    
-    all_relations = {}
-    for index, sentence in enumerate(sentences):
-        output = MinIE(String(sentence), parser, MinIEMode.SAFE)
 
-        relations = []
-        for ap in output.getPropositions().elements():
-            if ap is not None:
-                subject, indicator, *object = ap.getTripleAsString().replace('"', '').split('\t')
-                object = ' '.join([obj for obj in object if obj])
-                relations.append([subject, indicator, object])
+def minie(sentences):
+    from jvm_worker import JVMClient
 
-        all_relations[index] = relations
+    sentences = list(sentences)
+    with JVMClient() as client, tqdm(total=len(sentences), desc='minie') as progress:
+        relations = client.extract('minie', sentences, progress=progress)
 
-    return all_relations
+    return dict(enumerate(relations, 1))
 
 
 def generate_triplets():
@@ -108,13 +118,13 @@ def generate_triplets():
     # dev(302) + hotpotqa + squad + strategyqa
     sentences = (Path(__file__).parent / 'all.txt').read_text().split('\n')
 
-    graphene_output = graphene(sentences)
+    graphene_output = graphene_async(sentences)
     graphene_output_file.write_text(json.dumps(graphene_output, indent=2))
 
     stanford_output = stanford(sentences)
     stanford_output_file.write_text(json.dumps(stanford_output, indent=2))
 
-    minie_output = stanford(sentences)
+    minie_output = minie(sentences)
     minie_output_file.write_text(json.dumps(minie_output, indent=2))
 
 
@@ -0,0 +1 @@
+# 各模块都在仓库根目录下, tests/里的测试直接 import main, backend, ...
@@ -0,0 +1,114 @@
+import argparse
+import json
+import re
+import zipfile
+from pathlib import Path
+
+from backend import default_parser
+from cache import CachedParser, ParseCache
+from main import _iter_lines, iter_uniOIE
+from relation import to_json
+
+# 多个输入(all.txt, questions.zip里的*_questions.txt, ...)中相同的句子只解析一次
+# 只有空白不同的句子也视为同一个句子, 抽取结果再分发回每个引用它的 (source, index)
+
+ROOT = Path(__file__).parent
+SPACES = re.compile(r'\s+')
+
+
+def normalize(sentence):
+    return SPACES.sub(' ', sentence).strip()
+
+
+def load_questions(archive=ROOT / 'questions.zip'):
+    """{'hotpotqa': [问句, ...], ...}, 来自 questions/*_questions.txt"""
+    questions = {}
+    with zipfile.ZipFile(archive) as z:
+        for name in z.namelist():
+            if name.endswith('_questions.txt'):
+                questions[Path(name).name[:-len('_questions.txt')]] = z.read(name).decode().split('\n')
+    return questions
+
+
+class SentencePool:
+
+    def __init__(self):
+        # 规范化后的句子 -> 唯一句子的序号
+        self.keys = {}
+        # 每个唯一句子第一次出现时的原文, 解析的就是它
+        self.unique = []
+        # (source, index, 唯一句子的序号)
+        self.references = []
+        self.exact = self.variants = 0
+        self._seen = set()
+
+    def add(self, source, sentences, start=1):
+        for index, sentence in enumerate(_iter_lines(sentences), start):
+            key = normalize(sentence)
+            if key in self.keys:
+                if sentence in self._seen:
+                    self.exact += 1
+                else:
+                    self.variants += 1
+            else:
+                self.keys[key] = len(self.unique)
+                self.unique.append(sentence)
+            self._seen.add(sentence)
+            self.references.append((source, index, self.keys[key]))
+        return self
+
+    def stats(self):
+        sources = {}
+        first = set()
+        for source, index, unique in self.references:
+            counts = sources.setdefault(source, {'sentences': 0, 'reused': 0})
+            counts['sentences'] += 1
+            # 在这之前已经被某个输入引用过的句子不需要再解析
+            if unique in first:
+                counts['reused'] += 1
+            first.add(unique)
+
+        total = len(self.references)
+        return {
+            'sentences': total,
+            'unique': len(self.unique),
+            'reused': total - len(self.unique),
+            'exact_duplicates': self.exact,
+            'whitespace_variants': self.variants,
+            'reuse_ratio': (total - len(self.unique)) / total if total else 0.0,
+            'sources': sources,
+        }
+
+    def extract(self, parser=None, batch_size=64, metrics=None):
+        """{source: {index: relation}}, 每个唯一的句子只解析和抽取一次"""
+        relations = [None] * len(self.unique)
+        for unique, relation in iter_uniOIE(self.unique, batch_size, parser, start=0, metrics=metrics):
+            relations[unique] = relation
+
+        # Relation是不可变的, 多个index可以共用同一个对象
+        results = {}
+        for source, index, unique in self.references:
+            results.setdefault(source, {})[index] = relations[unique]
+        return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--sentences', default=str(ROOT / 'all.txt'))
+    arg_parser.add_argument('--questions', default=str(ROOT / 'questions.zip'))
+    arg_parser.add_argument('--output-dir', default='outputs/dedup')
+    args = arg_parser.parse_args()
+
+    pool = SentencePool().add('all', Path(args.sentences))
+    for name, questions in load_questions(args.questions).items():
+        pool.add(name, questions)
+
+    stats = pool.stats()
+    print(json.dumps(stats, indent=2))
+
+    parser = CachedParser(default_parser(), ParseCache(ROOT / '.cache/parse.sqlite'))
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # 与 outputs/*.output 相同的格式, 每个输入一个文件
+    for source, relations in pool.extract(parser).items():
+        (output_dir / f'{source}.output').write_text(json.dumps(relations, indent=2, default=to_json))
@@ -1,25 +1,29 @@
+import hashlib
 import json
+import os
 import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
 from main import DepTree
+from metrics import NULL_METRICS, Metrics
 from pathlib import Path
+from relation import Relation
+from store import Store, StoreBuilder, read_output_store, write_output_store
 
-class Triplet:
-
-    def __init__(self, subject, predicate, object):
-        self.subject, self.predicate, self.object = subject, predicate, object
-
-    def __str__(self):
-        return f'{self.subject} {self.predicate} {self.object}'
+# 与DepTree.relation共用同一种不可变节点
+Triplet = Relation
 
 
 def generate_modified_triplets(phrase: list):
     if len(phrase) <= 1:
         return phrase[0]['text']
 
-    basic_mod = Triplet(phrase[0]['text'], '@mod', phrase[1]['text'])
+    basic_mod = Triplet(phrase[0]['text'], '@mod', phrase[1]['text'], ids=(phrase[0]['index'], 0, phrase[1]['index']))
 
     for word in phrase[2:]:
-        basic_mod = Triplet(basic_mod, '@mod', word['text'])
+        basic_mod = Triplet(basic_mod, '@mod', word['text'], ids=(0, 0, word['index']))
 
     return basic_mod
 
@@ -52,18 +56,12 @@ def resolve_element(ele):
 
 
 def tuple_to_triplet(tuple):
-    subject, predicate, object = tuple
-
-    return Triplet(
-        resolve_element(subject),
-        resolve_element(predicate),
-        resolve_element(object),
-    )
+    return Triplet.from_list(tuple)
 
 
 # 输入标准树，生成所有潜在triplets，然后进行对比
-def load_ann(annotation_file):
-    annotation = json.loads(annotation_file.read_text())
+def parse_ann(text):
+    annotation = json.loads(text)
 
     sentence = annotation['sentence']
     relation = _resolve(annotation['relations'][0])
@@ -73,44 +71,128 @@ def load_ann(annotation_file):
     return sentence, relation
 
 
+def load_ann(annotation_file):
+    return parse_ann(annotation_file.read_text())
+
+
+# dev(302) + hotpotqa + squad + strategyqa, index与all.txt的行号对应
+SPLITS = [
+    {'name': 'dev', 'archive': 'dev.zip', 'member': 'dev/{}.json', 'count': 302, 'offset': 0, 'skip': [50]},
+    {'name': 'hotpotqa', 'archive': 'questions.zip', 'member': 'questions/hotpotqa/{}.json', 'count': 100, 'offset': 302, 'skip': []},
+    {'name': 'squad', 'archive': 'questions.zip', 'member': 'questions/squad/{}.json', 'count': 100, 'offset': 402, 'skip': []},
+    {'name': 'strategyqa', 'archive': 'questions.zip', 'member': 'questions/strategyqa/{}.json', 'count': 100, 'offset': 502, 'skip': [93]},
+]
+
+
+def split_indices(split):
+    return [
+        number + split['offset']
+        for number in range(1, split['count'] + 1)
+        if number not in split['skip']
+    ]
+
+
+def _index_metadata(root, splits):
+    archives = sorted({split['archive'] for split in splits})
+    return {
+        'splits': splits,
+        'archives': {name: hashlib.sha256((root / name).read_bytes()).hexdigest() for name in archives},
+    }
+
+
+def build_annotation_index(index_file, splits=SPLITS, root=Path(__file__).parent):
+    # 直接读zip里的json, 不需要先解压
+    builder = StoreBuilder()
+    archives = {}
+    for split in splits:
+        if split['archive'] not in archives:
+            archives[split['archive']] = zipfile.ZipFile(root / split['archive'])
+        archive = archives[split['archive']]
+
+        for index in split_indices(split):
+            sentence, relation = parse_ann(archive.read(split['member'].format(index - split['offset'])).decode('utf-8'))
+            builder.add(index, [relation], sentence)
+
+    for archive in archives.values():
+        archive.close()
+
+    builder.write(index_file, metadata=_index_metadata(root, splits))
+
+
+def load_annotations(index_file=None, splits=SPLITS, root=Path(__file__).parent):
+    """{index: (sentence, gold relation)}, 第一次从zip建索引, 之后mmap索引文件"""
+    index_file = Path(index_file or root / '.cache/annotations.idx')
+
+    store = Store(index_file) if index_file.exists() else None
+    # zip内容或者split配置变了就重建
+    if store is None or store.metadata != json.loads(json.dumps(_index_metadata(root, splits))):
+        build_annotation_index(index_file, splits, root)
+        store = Store(index_file)
+
+    return {int(index): (store.text(int(index)), store.relations(int(index))[0]) for index in store.keys}
+
+
+def _preorder(annotation: Triplet):
+    # 非递归的先序遍历: 节点, subject子树, predicate子树, object子树
+    nodes, stack = [], [annotation]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(ele for ele in (node.object, node.predicate, node.subject) if type(ele) is Triplet)
+    return nodes
+
+
 def generate_all_triplets(annotation: Triplet):
-    # def _element_to_str(ele):
-    #     if type(ele) is str:
-    #         return ele
-    #     return re.sub(
-    #         '\s+', ' ',
-    #         f'{_element_to_str(ele)}'
-    #     )
+    # 自底向上, 每个子树的字符串只拼接一次, 祖先直接复用
+    texts = {}
+    def _text(ele):
+        return texts[id(ele)] if type(ele) is Triplet else str(ele)
+
+    nodes = _preorder(annotation)
+    for node in reversed(nodes):
+        texts[id(node)] = f'{_text(node.subject)} {_text(node.predicate)} {_text(node.object)}'
+
+    return [(_text(node.subject), _text(node.predicate), _text(node.object)) for node in nodes]
 
-    all_triplets = [(
-        str(annotation.subject), str(annotation.predicate), str(annotation.object)
-    )]
 
-    if type(annotation.subject) is Triplet:
-        all_triplets += generate_all_triplets(annotation.subject)
-    if type(annotation.predicate) is Triplet:
-        all_triplets += generate_all_triplets(annotation.predicate)
-    if type(annotation.object) is Triplet:
-        all_triplets += generate_all_triplets(annotation.object)
+MARKERS = frozenset(['@mod', '@conj', '@be', '@null', '@cons', 'BE', 'AND', 'OR', 'CONSTRAIN'])
+SPACES = re.compile(r'\s+')
 
-    return all_triplets
+
+@lru_cache(maxsize=1 << 16)
+def _normalize(text):
+    text = ' '.join([word for word in text.split(' ') if not word in MARKERS])
+    return SPACES.sub(' ', text).strip().lower()
 
 
 def triplets_to_texts(triplets, remove=['@']):
-    triplet_texts = []
-    for triplet in triplets:
-        # if triplet[0] in ['@mod', '@conj']:
-            # continue
+    return {_normalize(' '.join(triplet)) for triplet in triplets}
+
+
+def triplet_text_list(annotation: Triplet):
+    """triplets_to_texts(generate_all_triplets(annotation)) 去重前的列表, 一次遍历完成
+
+    按空格切词后去掉标记词再合并空白, 对拼接前的每个元素分别做结果相同,
+    所以每个子树规范化后的文本只算一次
+    """
+    texts = {}
+    def _text(ele):
+        return texts[id(ele)] if type(ele) is Triplet else _normalize(str(ele))
 
-        text = ' '.join(triplet)
-        text = ' '.join([word for word in text.split(' ') if not word in ['@mod', '@conj', '@be', '@null', '@cons', 'BE', 'AND', 'OR', 'CONSTRAIN']])
-        text = re.sub(
-            '\s+', ' ',
-            text,
-        ).strip().lower()
-        triplet_texts.append(text)
+    def _join(node):
+        return ' '.join([text for text in (_text(node.subject), _text(node.predicate), _text(node.object)) if text])
+
+    nodes = _preorder(annotation)
+    for node in reversed(nodes):
+        texts[id(node)] = _join(node)
+
+    return [texts[id(node)] for node in nodes]
+
+
+def triplet_texts(annotation: Triplet):
+    # 按先序插入, 与原来得到的集合迭代顺序相同
+    return set(triplet_text_list(annotation))
 
-    return set(triplet_texts)
 
 def evaluate(gold_relations: set, predicted_relations: set):
     tp = len(gold_relations & predicted_relations)
@@ -129,23 +211,39 @@ def mean(lst):
     if len(lst) == 0:return 0
     return sum(lst) / len(lst)
 
+def _token_matrix(texts, vocab):
+    # 每行一个relation, 列是词id, 只保留vocab中的词
+    matrix = np.zeros((len(texts), len(vocab)), dtype=np.int32)
+    for row, words in enumerate(texts):
+        columns = [vocab[word] for word in words if word in vocab]
+        matrix[row, columns] = 1
+    return matrix
+
+
 def evaluate_token(gold_relations: set, predicted_relations: set):
-    recalls = []; precisions = []
-    for predict in predicted_relations:
-        max_tp = -1; gold_len = 0
-        p_words = predict.split(' ')
-        for gold in gold_relations:
-            g_words = gold.split(' ')
-
-            tp = len(set(p_words) & set(g_words))
-            if tp > max_tp:
-                max_tp = tp
-                gold_len = len(set(g_words))
-
-        recalls.append(tp / gold_len)
-        precisions.append(tp / len(p_words))
+    if not predicted_relations or not gold_relations:
+        return 0, 0, 0
+
+    gold_words = [gold.split(' ') for gold in gold_relations]
+    p_words = [predict.split(' ') for predict in predicted_relations]
+
+    vocab = {}
+    for words in gold_words:
+        for word in words:
+            vocab.setdefault(word, len(vocab))
+
+    # overlap[i, j] = |set(p_words[i]) & set(gold_words[j])|
+    overlap = _token_matrix(p_words, vocab) @ _token_matrix(gold_words, vocab).T
+    # 每个预测取重合最多的gold(相同时取第一个)的长度作为分母
+    best = overlap.argmax(axis=1)
+    gold_len = np.array([len(set(words)) for words in gold_words])[best]
+    # 与原来的循环一致, 分子是与最后一个gold的重合数
+    tp = overlap[:, -1]
+
+    recalls = tp / gold_len
+    precisions = tp / np.array([len(words) for words in p_words])
     
-    recall, precision = mean(recalls), mean(precisions)
+    recall, precision = mean(recalls.tolist()), mean(precisions.tolist())
     f1 = (2 * recall * precision) / (recall + precision) if recall + precision != 0 else 0
 
     return recall, precision, f1
@@ -153,94 +251,251 @@ def evaluate_token(gold_relations: set, predicted_relations: set):
 
 
 def relation_to_triplet(relation) -> Triplet:
-    subj, pred, obj = relation
+    return Triplet.from_list(relation)
+
+
+SYSTEMS = [
+    ('reverb', False),
+    ('stanford', False),
+    ('clausie', False),
+    ('minie', False),
+    ('graphene', False),
+    ('deepseek-chat', True),
+    ('uniOIE', True),
+]
+
+# 规范化文本或打分的规则变化时加一, 让旧缓存失效
+TEXT_CACHE_VERSION = 1
 
-    return Triplet(
-        subj if type(subj) is str else relation_to_triplet(subj),
-        pred if type(pred) is str else relation_to_triplet(pred),
-        obj if type(obj) is str else relation_to_triplet(obj),
-    )
 
+def _digest(data):
+    return hashlib.sha256(data if type(data) is bytes else data.encode()).hexdigest()[:16]
 
-def evaluate_dataset(annotations):
-    for model_name, nest in [
-        ('reverb', False),
-        ('stanford', False),
-        ('clausie', False),
-        ('minie', False),
-        ('graphene', False),
-        ('deepseek-chat', True),
-        ('uniOIE', True),
-    ]:
-        all_relations = json.loads((Path(__file__).parent / f'outputs/{model_name}.output').read_text())
-        
-        recalls, precisions, f1s = [], [], []
-        t_recalls, t_precisions, t_f1s = [], [], []
-
-        for index, (sentence, gold) in annotations.items():
-            gold_relations = triplets_to_texts(generate_all_triplets(gold))
-
-            if nest:
-            # 嵌套，只有一个根关系
-                if all_relations[str(index)] == []:
-                    predicted_relations = set()
-                else:
-                    predicted_relations = triplets_to_texts(generate_all_triplets(tuple_to_triplet(all_relations[str(index)])))
 
+def _read_cache(cache_file):
+    if cache_file is None or not cache_file.exists():
+        return None
+    cache = json.loads(cache_file.read_text())
+    return cache if cache.get('version') == TEXT_CACHE_VERSION else None
+
+
+def _write_cache(cache_file, cache):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_file.write_text(json.dumps(cache))
+    tmp_file.replace(cache_file)
+
+
+def convert_outputs(systems=SYSTEMS, root=Path(__file__).parent):
+    """把 outputs/{model}.output 转换成 outputs/{model}.store, 并检查能还原成原来的json"""
+    for model_name, nest in systems:
+        output_file = root / f'outputs/{model_name}.output'
+        store_file = output_file.with_suffix('.store')
+        content = output_file.read_text()
+        write_output_store(json.loads(content), store_file, nest)
+        if json.dumps(read_output_store(Store(store_file)), indent=2) != content:
+            store_file.unlink()
+            raise ValueError(f'{output_file} does not round-trip through the store')
+
+
+def store_text_lists(store):
+    """与system_text_lists相同的结果, 直接在store的数组上计算, 不构造Triplet"""
+    nodes = store.nodes.tolist()
+    normalized = {}
+
+    # 节点按后序排列, 子节点的文本总是先算好
+    texts = []
+    for refs in nodes:
+        parts = []
+        for ref in refs:
+            if ref >= 0:
+                text = texts[ref]
             else:
-            # 多个关系
-                predicted_relations = set()
-                for r in all_relations[str(index)]:
-                    predicted_relations |= triplets_to_texts(generate_all_triplets(tuple_to_triplet(r)))
+                if ref not in normalized:
+                    normalized[ref] = _normalize(store.string(-ref - 1))
+                text = normalized[ref]
+            if text:
+                parts.append(text)
+        texts.append(' '.join(parts))
+
+    roots, offsets = store.roots.tolist(), store.sentence_offsets.tolist()
+    text_lists = {}
+    for position, key in enumerate(store.keys.tolist()):
+        lists = []
+        for root in roots[offsets[position]:offsets[position + 1]]:
+            # 与_preorder相同的先序
+            text_list, stack = [], [root]
+            while stack:
+                node = stack.pop()
+                text_list.append(texts[node])
+                stack.extend(ref for ref in reversed(nodes[node]) if ref >= 0)
+            lists.append(text_list)
+        text_lists[key] = lists
+    return text_lists
+
+
+def system_text_lists(model_name, nest, cache_dir=None):
+    """{index: [每个预测关系的triplet_text_list]}
+
+    有比json新的 outputs/{model}.store 时直接从store计算;
+    否则缓存在磁盘上: 输出文件的hash没变时直接读取, 变了的话只重新计算关系有变化的句子
+    """
+    output_file = Path(__file__).parent / f'outputs/{model_name}.output'
+    store_file = output_file.with_suffix('.store')
+    if store_file.exists() and (not output_file.exists() or store_file.stat().st_mtime >= output_file.stat().st_mtime):
+        store = Store(store_file)
+        if store.metadata.get('nest') != nest:
+            raise ValueError(f'{store_file} was built with nest={store.metadata.get("nest")}, expected {nest}')
+        return store_text_lists(store)
+
+    content = output_file.read_bytes()
+    file_hash = _digest(content + str(nest).encode())
+
+    cache_file = Path(cache_dir) / f'{model_name}.texts.json' if cache_dir is not None else None
+    cache = _read_cache(cache_file) or {'version': TEXT_CACHE_VERSION, 'file': None, 'entries': {}}
+    if cache['file'] == file_hash:
+        return {int(index): lists for index, (_, lists) in cache['entries'].items()}
+
+    entries = {}
+    for index, relations in json.loads(content).items():
+        relation_hash = _digest(json.dumps(relations))
+        if index in cache['entries'] and cache['entries'][index][0] == relation_hash:
+            entries[index] = cache['entries'][index]
+            continue
+
+        if nest:
+        # 嵌套，只有一个根关系
+            relations = [relations] if relations != [] else []
+        # 多个关系
+        entries[index] = [relation_hash, [triplet_text_list(tuple_to_triplet(r)) for r in relations]]
+
+    if cache_file is not None:
+        _write_cache(cache_file, {'version': TEXT_CACHE_VERSION, 'file': file_hash, 'entries': entries})
+
+    return {int(index): lists for index, (_, lists) in entries.items()}
+
+
+def _predicted_set(text_lists):
+    # 与原来一样逐个关系求并集, 集合的迭代顺序不变
+    predicted_relations = set()
+    for text_list in text_lists:
+        predicted_relations |= set(text_list)
+    return predicted_relations
+
+
+def score_system(model_name, nest, gold_lists, cache_dir=None, collect_metrics=False):
+    """返回 (model_name, {index: (recall, precision, f1, t_recall, t_precision, t_f1)}, 重新打分的句子数, 统计)
+
+    每个句子的分数按 gold + 预测文本 缓存, 只有变化了的句子重新打分
+    统计是 Metrics.to_dict() 的结果, collect_metrics为False时是None
+    """
+    metrics = Metrics() if collect_metrics else NULL_METRICS
+    with metrics.timer('eval.flatten'):
+        text_lists = system_text_lists(model_name, nest, cache_dir)
+
+    cache_file = Path(cache_dir) / f'{model_name}.scores.json' if cache_dir is not None else None
+    cache = _read_cache(cache_file) or {'version': TEXT_CACHE_VERSION, 'entries': {}}
+    # token级分数与集合的迭代顺序有关, 固定PYTHONHASHSEED时分数只在同一个seed下复用
+    seed = os.environ.get('PYTHONHASHSEED')
+
+    scores, rescored = {}, 0
+    with metrics.timer('eval.score'):
+        for index, gold_list in gold_lists.items():
+            key = _digest(json.dumps([gold_list, text_lists[index], seed]))
+            cached = cache['entries'].get(str(index))
+            if cached is not None and cached[0] == key:
+                scores[index] = tuple(cached[1])
+                continue
+
+            gold_relations = set(gold_list)
+            predicted_relations = _predicted_set(text_lists[index])
+            scores[index] = (
+                evaluate(gold_relations, predicted_relations) +
+                evaluate_token(gold_relations, predicted_relations)
+            )
+            cache['entries'][str(index)] = [key, scores[index]]
+            rescored += 1
+
+        if cache_file is not None and rescored:
+            _write_cache(cache_file, cache)
+
+    metrics.count('eval_sentences', len(scores), model=model_name)
+    metrics.count('eval_rescored', rescored, model=model_name)
+
+    return model_name, scores, rescored, metrics.to_dict() if metrics else None
+
+
+def _summarize(model_name, scores, rescored, _metrics=None):
+    columns = ['recall', 'precision', 'f1', 't_recall', 't_precision', 't_f1']
+    rows = list(scores.values())
+    result = {'model': model_name, 'count': len(rows), 'rescored': rescored}
+    for column, values in zip(columns, zip(*rows)):
+        result[column] = sum(values) / len(values) * 100
+    return result
+
 
-            recall, precision, f1 = evaluate(gold_relations, predicted_relations)
-            recalls.append(recall); precisions.append(precision); f1s.append(f1)
-            t_recall, t_precision, t_f1 = evaluate_token(gold_relations, predicted_relations)
-            t_recalls.append(t_recall); t_precisions.append(t_precision); t_f1s.append(t_f1)
+def evaluate_dataset(annotations, systems=SYSTEMS, workers=None, cache_dir=None, metrics=None):
+    """返回每个系统一行的结果表 [{'model', 'precision', 'recall', 'f1', 't_precision', ...}]
+
+    metrics: 可选的 metrics.Metrics, 汇总各个系统的flatten/打分耗时
+    """
+    # gold只算一次, 各个系统共用
+    metrics = metrics or NULL_METRICS
+    with metrics.timer('eval.gold'):
+        gold_lists = {index: triplet_text_list(gold) for index, (sentence, gold) in annotations.items()}
 
-        print(f'=============\n{model_name}\n')
-        print('precision: ', sum(precisions) / len(precisions) * 100)
-        print('recall: ', sum(recalls) / len(recalls) * 100)
-        print('f1: ', sum(f1s) / len(f1s) * 100)
+    arguments = [(model_name, nest, gold_lists, cache_dir, bool(metrics)) for model_name, nest in systems]
+    if workers == 1:
+        results = [score_system(*argument) for argument in arguments]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(score_system, *zip(*arguments)))
 
-        print('t_precision: ', sum(t_precisions) / len(t_precisions) * 100)
-        print('t_recall: ', sum(t_recalls) / len(t_recalls) * 100)
-        print('t_f1: ', sum(t_f1s) / len(t_f1s) * 100)
+    for *_, system_metrics in results:
+        if system_metrics:
+            metrics.merge(system_metrics)
+
+    return [_summarize(*result) for result in results]
+
+
+def print_results(results):
+    for result in results:
+        print(f'=============\n{result["model"]}\n')
+        print('precision: ', result['precision'])
+        print('recall: ', result['recall'])
+        print('f1: ', result['f1'])
+
+        print('t_precision: ', result['t_precision'])
+        print('t_recall: ', result['t_recall'])
+        print('t_f1: ', result['t_f1'])
 
 
 
 
 def main():
-    annotations = {}
-
-    for index in range(1, 303):
-        if index == 50: continue
-        file = Path(__file__).parent / 'dev' / f'{index}.json'
-        annotations[index] = load_ann(file)
-
-    # dev(302) + hotpotqa + squad + strategyqa
-    for index in range(1, 101):
-        file = Path(__file__).parent / 'questions/hotpotqa' / f'{index}.json'
-        annotations[index + 302] = load_ann(file)
-    for index in range(1, 101):
-        file = Path(__file__).parent / 'questions/squad' / f'{index}.json'
-        annotations[index + 402] = load_ann(file)
-    for index in range(1, 101):
-        if index == 93: continue
-        file = Path(__file__).parent / 'questions/strategyqa' / f'{index}.json'
-        annotations[index + 502] = load_ann(file)
+    annotations = load_annotations()
 
     assert len(annotations) == 600
 
-    print('sentence============\n')
+    cache_dir = Path(__file__).parent / '.cache/eval'
+    sentence_indices = set(split_indices(SPLITS[0]))
 
-    evaluate_dataset({k: v for k, v in annotations.items() if k <= 302})
+    print('sentence============\n')
+    print_results(evaluate_dataset({k: v for k, v in annotations.items() if k in sentence_indices}, cache_dir=cache_dir))
 
     print('question============\n')
-    evaluate_dataset({k: v for k, v in annotations.items() if k > 302})
+    print_results(evaluate_dataset({k: v for k, v in annotations.items() if k not in sentence_indices}, cache_dir=cache_dir))
 
 
 if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--convert-outputs', action='store_true', help='先把所有系统的输出转换成store, 评测直接mmap读取')
+    args = arg_parser.parse_args()
+
+    if args.convert_outputs:
+        convert_outputs()
     main()
 
 
@@ -0,0 +1,64 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+# 本地回放Graphene的响应, 不需要启动真正的Graphene服务就能测试compare.graphene_async
+
+def load_recordings(recordings_file=None):
+    """{sentence: Graphene响应}, 没有录制文件时用all.txt和outputs/graphene.output拼出来"""
+    if recordings_file is not None:
+        return json.loads(Path(recordings_file).read_text())
+
+    root = Path(__file__).parent
+    sentences = (root / 'all.txt').read_text().split('\n')
+    outputs = json.loads((root / 'outputs/graphene.output').read_text())
+
+    recordings = {}
+    for index, sentence in enumerate(sentences, 1):
+        recordings[sentence] = {'sentences': [{'extractionMap': {
+            str(number): {'arg1': arg1, 'relation': relation, 'arg2': arg2}
+            for number, (arg1, relation, arg2) in enumerate(outputs.get(str(index), []))
+        }}]}
+    return recordings
+
+
+def make_server(recordings, host='localhost', port=8080, latency=0.0):
+    empty = {'sentences': [{'extractionMap': {}}]}
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            if self.path != '/relationExtraction/text':
+                self.send_error(404)
+                return
+
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            # 模拟服务端的处理时间
+            time.sleep(latency)
+            body = json.dumps(recordings.get(request['text'], empty)).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument('--recordings', default=None, help='{sentence: response} 的json文件')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟延迟(秒)')
+    args = arg_parser.parse_args()
+
+    server = make_server(load_recordings(args.recordings), port=args.port, latency=args.latency)
+    print(f'graphene stub on http://localhost:{args.port}/relationExtraction/text')
+    server.serve_forever()
@@ -0,0 +1,90 @@
+import hashlib
+import inspect
+import json
+from pathlib import Path
+
+from cache import compact
+from jsonl import JsonlWriter, dump_output, load_output
+from main import DepTree
+
+# 每个句子记录: 输入文本的hash, 解析结果的hash, 规则代码的版本
+# 只有发生变化的句子才重新建树, 其余的直接沿用 outputs/uniOIE.output
+
+
+def _hash(data):
+    return hashlib.sha256(data if type(data) is bytes else data.encode()).hexdigest()[:16]
+
+
+def rule_fingerprint():
+    # DepTree的源码(遍历规则的_walk)或者规则表变了, 所有句子都要重新走一遍规则
+    # phrase_deprels是frozenset, repr的顺序随hash seed变化, 排序后再算
+    rules = DepTree.rules._replace(phrase_deprels=sorted(DepTree.rules.phrase_deprels))
+    return _hash(inspect.getsource(DepTree) + repr(rules))
+
+
+def load_manifest(manifest_file):
+    manifest_file = Path(manifest_file)
+    if not manifest_file.exists():
+        return {'rules': None, 'parser': None, 'sentences': {}}
+    return json.loads(manifest_file.read_text())
+
+
+def update(sentences, output_file, manifest_file, parser, batch_size=64, jsonl_file=None, relation_index=None):
+    """重新抽取过期的句子并拼接回output_file, 返回重新计算的index列表
+
+    jsonl_file: main.py的 outputs/uniOIE.jsonl, 同时重写, 否则之后的普通运行会用旧的jsonl覆盖output_file
+    relation_index: relation_index.RelationIndex, 重新索引变化了的句子, 去掉已经不存在的句子
+    """
+    output_file = Path(output_file)
+    manifest = load_manifest(manifest_file)
+    all_relations = load_output(output_file) if output_file.exists() else {}
+
+    rules = rule_fingerprint()
+    parser_fingerprint = getattr(parser, 'fingerprint', type(parser).__name__)
+    # 规则或解析器变了, 所有句子都是候选; 否则只看输入变了的句子
+    everything = manifest['rules'] != rules or manifest['parser'] != parser_fingerprint
+
+    entries = {}
+    candidates = []
+    for index, sentence in enumerate(sentences, 1):
+        key = str(index)
+        entry = manifest['sentences'].get(key)
+        input_hash = _hash(sentence)
+        if everything or entry is None or entry['input'] != input_hash or key not in all_relations:
+            candidates.append((key, sentence, input_hash))
+        else:
+            entries[key] = entry
+
+    changed = []
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        for (key, sentence, input_hash), parsed in zip(batch, parser.parse_batch([sentence for _, sentence, _ in batch])):
+            parse_hash = _hash(compact(parsed))
+            entry = manifest['sentences'].get(key)
+
+            # 输入和解析结果都没变, 规则也没变时不需要重新建树
+            unchanged = (
+                entry is not None and key in all_relations and manifest['rules'] == rules and
+                entry['input'] == input_hash and entry['parse'] == parse_hash
+            )
+            if not unchanged:
+                all_relations[key] = DepTree(sentence, parsed).relation
+                changed.append(int(key))
+            entries[key] = {'input': input_hash, 'parse': parse_hash}
+
+    # 句子变少时去掉多余的index
+    dropped = [int(key) for key in all_relations if int(key) > len(sentences)]
+    all_relations = {str(index): all_relations[str(index)] for index in range(1, len(sentences) + 1)}
+
+    if relation_index is not None:
+        relation_index.remove_many(dropped)
+        relation_index.replace_many((index, all_relations[str(index)]) for index in changed)
+
+    if jsonl_file is not None:
+        with JsonlWriter(jsonl_file, resume=False) as writer:
+            for key, relation in all_relations.items():
+                writer.write(int(key), relation)
+    output_file.write_text(dump_output(all_relations))
+    Path(manifest_file).write_text(json.dumps({'rules': rules, 'parser': parser_fingerprint, 'sentences': entries}))
+
+    return changed
@@ -0,0 +1,106 @@
+import json
+import os
+import re
+from pathlib import Path
+
+from relation import dumps, loads
+
+# json.loads在很深的relation上会RecursionError, 这时按JsonlWriter写出的格式自己解析
+RECORD = re.compile(r'\{"index": (\d+), "relation": (.*)\}\n', re.S)
+# dump_output里每个句子从行首的 '  "index": ' 开始, relation内部的缩进更深
+OUTPUT_ITEM = re.compile(r'^  "(\d+)": ', re.M)
+
+
+class JsonlWriter:
+    """每个句子写一行 {"index": i, "relation": ...}, 定期fsync, 中断后可以接着写"""
+
+    def __init__(self, path, fsync_every=64, resume=True):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        if resume:
+            _drop_partial_line(self.path)
+        self.file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+        self._pending = 0
+
+    def write(self, index, relation):
+        # 与 json.dumps({'index': index, 'relation': relation}, ensure_ascii=False) 相同
+        self.file.write(f'{{"index": {index}, "relation": {dumps(relation, ensure_ascii=False)}}}\n')
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _drop_partial_line(path):
+    # 进程被杀时最后一行可能只写了一半
+    if not path.exists():
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except RecursionError:
+                index, relation = RECORD.fullmatch(line).groups()
+                record = {'index': int(index), 'relation': loads(relation)}
+            yield record['index'], record['relation']
+
+
+def written_indices(path):
+    # 并行时各个shard完成的顺序不定, 中断后要看哪些index已经写过, 而不是最大的index
+    path = Path(path)
+    if not path.exists():
+        return set()
+    return {index for index, _ in read_jsonl(path)}
+
+
+def export_output(jsonl_path, output_path):
+    # 转换成eval.py读取的 outputs/*.output 格式
+    all_relations = dict(read_jsonl(jsonl_path))
+    all_relations = {index: all_relations[index] for index in sorted(all_relations)}
+    Path(output_path).write_text(dump_output(all_relations))
+
+    return all_relations
+
+
+def dump_output(all_relations):
+    """与 json.dumps(all_relations, indent=2, default=to_json) 相同, 很深的relation也能写出"""
+    if not all_relations:
+        return '{}'
+    items = ',\n'.join(f'  {json.dumps(str(index))}: {dumps(relation, 2, 1)}' for index, relation in all_relations.items())
+    return '{\n' + items + '\n}'
+
+
+def load_output(output_path):
+    """dump_output的逆过程, 很深的relation也能读入"""
+    text = Path(output_path).read_text()
+    try:
+        return json.loads(text)
+    except RecursionError:
+        parts = OUTPUT_ITEM.split(text.strip()[1:-1])
+        return {key: loads(value.strip().rstrip(',')) for key, value in zip(parts[1::2], parts[2::2])}
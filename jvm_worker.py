@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# 常驻进程: JVM和MinIE/Stanford模型只在启动后加载一次, compare.py通过unix socket批量发送句子
+# 协议: 每行一个json请求 {"extractor": "minie", "sentences": [...]}
+#       每行一个json响应 {"relations": [[[s, r, o], ...], ...]} 或 {"error": "..."}
+
+SOCKET_PATH = os.environ.get('UNIOIE_JVM_SOCKET', '/tmp/uniOIE-jvm.sock')
+MINIE_CLASSPATH = '/home/lee/openIE/LinkingConcepts/zoo/minie/miniepy/target/minie-0.0.1-SNAPSHOT.jar'
+
+
+class MinIEExtractor:
+
+    def __init__(self):
+        os.environ['CLASSPATH'] = os.environ.get('MINIE_CLASSPATH', MINIE_CLASSPATH)
+
+        from jnius import autoclass
+
+        CoreNLPUtils = autoclass('de.uni_mannheim.utils.coreNLP.CoreNLPUtils')
+        self.MinIE = autoclass('de.uni_mannheim.minie.MinIE')
+        self.String = autoclass('java.lang.String')
+        self.mode = autoclass('de.uni_mannheim.minie.MinIE$Mode').SAFE
+
+        self.parser = CoreNLPUtils.StanfordDepNNParser()
+
+    def extract(self, sentence):
+        output = self.MinIE(self.String(sentence), self.parser, self.mode)
+
+        relations = []
+        for ap in output.getPropositions().elements():
+            if ap is not None:
+                subject, indicator, *object = ap.getTripleAsString().replace('"', '').split('\t')
+                object = ' '.join([obj for obj in object if obj])
+                relations.append([subject, indicator, object])
+        return relations
+
+
+class StanfordExtractor:
+
+    def __init__(self):
+        from openie import StanfordOpenIE
+        properties = {
+            'openie.affinity_probability_cap': 2 / 3,
+        }
+
+        self.client = StanfordOpenIE(properties=properties, install_dir_path='../stanfordOIE')
+        self.client.__enter__()
+
+    def extract(self, sentence):
+        relations = []
+        for relation in self.client.annotate(sentence):
+            relations.append([
+                relation['subject'],
+                relation['relation'],
+                relation['object'],
+            ])
+        return relations
+
+
+EXTRACTORS = {
+    'minie': MinIEExtractor,
+    'stanford': StanfordExtractor,
+}
+
+
+class WorkerServer(socketserver.UnixStreamServer):
+    """单线程处理请求, pyjnius的对象只在这个线程里使用"""
+
+    def __init__(self, path=SOCKET_PATH, extractors=EXTRACTORS):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.extractor_classes = extractors
+        self.extractors = {}
+        super().__init__(path, WorkerHandler)
+
+    def extractor(self, name):
+        # 第一次用到时才启动对应的JVM/模型, 之后一直保持
+        if name not in self.extractors:
+            self.extractors[name] = self.extractor_classes[name]()
+        return self.extractors[name]
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                extractor = self.server.extractor(request['extractor'])
+                response = {'relations': [extractor.extract(sentence) for sentence in request['sentences']]}
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class JVMClient:
+
+    def __init__(self, path=SOCKET_PATH, start=True, start_timeout=60):
+        self.path = path
+        if start and not _can_connect(path):
+            start_worker(path, start_timeout)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('rwb')
+
+    def extract(self, extractor, sentences, batch_size=64, progress=None):
+        # progress: tqdm等有update(n)的对象, 每个batch返回后前进这个batch的句子数
+        sentences = list(sentences)
+        relations = []
+        for start in range(0, len(sentences), batch_size):
+            request = {'extractor': extractor, 'sentences': sentences[start:start + batch_size]}
+            self.file.write(json.dumps(request).encode() + b'\n')
+            self.file.flush()
+
+            response = json.loads(self.file.readline())
+            if 'error' in response:
+                raise RuntimeError(f'{extractor} worker: {response["error"]}')
+            relations.extend(response['relations'])
+            if progress is not None:
+                progress.update(len(request['sentences']))
+        return relations
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def start_worker(path=SOCKET_PATH, timeout=60):
+    # 后台启动, 与当前脚本的生命周期无关
+    subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), '--socket', path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if _can_connect(path):
+            return
+        time.sleep(0.1)
+    raise TimeoutError(f'jvm worker did not start on {path}')
+
+
+def _can_connect(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--socket', default=SOCKET_PATH)
+    args = arg_parser.parse_args()
+
+    WorkerServer(args.socket).serve_forever()
@@ -1,33 +1,153 @@
-import stanza
+from backend import PROFILES, BucketedParser, default_parser, from_conllu, profile_parser
+from cache import CachedParser, ParseCache
+from jsonl import JsonlWriter, export_output, read_jsonl, written_indices
+from metrics import NULL_METRICS, Metrics
+from relation import Relation
 from collections import namedtuple
 from pathlib import Path
 from tqdm import tqdm
-import json
 
 Word = namedtuple('Word', ['text', 'pos', 'index'])
 Node = namedtuple('Node', ['word', 'children'])
 
-stanza_parser = stanza.Pipeline(lang='en', processors='tokenize,mwt,pos,lemma,depparse', logging_level="ERROR", use_gpu=True, download_method=None)
+# _walk的栈上每一帧是一条规则的生成器, yield (CLAUSE/PHRASE, node) 请求解析子节点
+CLAUSE, PHRASE = 0, 1
+
+# 声明式的规则表, 每个walker按顺序匹配, 第一条命中的规则生效
+#   trigger:  触发的依存关系, 多个时取词序最靠前的child; None表示总是命中
+#   requires: trigger的child还必须有的依存关系(不消耗)
+#   marker:   在trigger的child下找连接词的依存关系, 找不到时用default
+#   shape:    输出的 (subject, predicate, object), 每个位置是
+#             字符串常量, MARKER, (CLAUSE/PHRASE, NODE/TRIGGER/依存关系) 或者嵌套的shape
+# 没有规则命中的短语就是这个词本身
+Rule = namedtuple('Rule', ['name', 'trigger', 'shape', 'marker', 'default', 'requires'], defaults=[None, '', None])
+# 编译后的规则: shape展开成按求值顺序排列的steps, layout记录怎样拼回嵌套的tuple
+CompiledRule = namedtuple('CompiledRule', ['name', 'trigger', 'requires', 'marker', 'default', 'steps', 'layout'])
+RuleSet = namedtuple('RuleSet', ['clause', 'phrase', 'phrase_deprels'])
+
+NODE, TRIGGER = 'node', 'trigger'
+MARKER, CONST = 2, 3
+
+CLAUSE_RULES = [
+    # 并列的clause
+    Rule('conj', 'conj', ((CLAUSE, NODE), MARKER, (CLAUSE, TRIGGER)), marker='cc', default='@conj', requires='nsubj'),
+    # SVC
+    Rule('svc', 'cop', ((PHRASE, 'nsubj'), (PHRASE, TRIGGER), (PHRASE, NODE))),
+    Rule('comp', ['xcomp', 'ccomp'], ((CLAUSE, NODE), MARKER, (CLAUSE, TRIGGER)), marker=['case', 'mark'], default='@cons'),
+    Rule('advcl', 'advcl', ((CLAUSE, NODE), MARKER, (CLAUSE, TRIGGER)), marker=['case', 'mark']),
+    # SVOO
+    Rule('svoo', 'iobj', (((PHRASE, 'nsubj'), (PHRASE, NODE), (PHRASE, TRIGGER)), '@cons', (PHRASE, 'obj'))),
+    # I give an apple to her
+    # give -> obl -> her
+    Rule('obl', 'obl', (((PHRASE, 'nsubj'), (PHRASE, NODE), (PHRASE, 'obj')), MARKER, (PHRASE, TRIGGER)), marker=['case', 'mark']),
+    # SVO
+    Rule('svo', 'obj', ((PHRASE, 'nsubj'), (PHRASE, NODE), (PHRASE, TRIGGER))),
+    # SV
+    Rule('sv', None, ((PHRASE, 'nsubj'), (PHRASE, NODE), '')),
+]
 
-class DepTree:
+PHRASE_RULES = [
+    Rule('conj', 'conj', ((PHRASE, NODE), MARKER, (PHRASE, TRIGGER)), marker='cc', default='@conj'),
+    Rule('mod', ['nummod', 'amod', 'det', 'advmod', 'compound', 'aux'], ((PHRASE, TRIGGER), '@mod', (PHRASE, NODE))),
+    Rule('nmod', 'nmod', ((PHRASE, TRIGGER), MARKER, (PHRASE, NODE)), marker='case', default='@mod'),
+    # 定语从句
+    Rule('acl', 'acl', ((PHRASE, NODE), MARKER, (CLAUSE, TRIGGER)), marker='case', default='@cons'),
+    Rule('appos', 'appos', ((PHRASE, NODE), '@be', (PHRASE, TRIGGER))),
+]
+
+
+def compile_rules(clause_rules, phrase_rules):
+    """把规则表编译成 RuleSet, 依存关系统一成tuple, 匹配时不需要再转换"""
+    def _tuple(deprels):
+        return (deprels,) if type(deprels) is str else tuple(deprels or ())
+
+    def _flatten(shape, steps):
+        layout = []
+        for slot in shape:
+            if type(slot) is str:
+                steps.append((CONST, slot))
+            elif slot is MARKER:
+                steps.append((MARKER, None))
+            elif len(slot) == 3:
+                layout.append(_flatten(slot, steps))
+                continue
+            else:
+                kind, source = slot
+                steps.append((kind, source if source in (NODE, TRIGGER) else _tuple(source)))
+            layout.append(len(steps) - 1)
+        return tuple(layout)
+
+    def _compile(rules):
+        compiled = []
+        for rule in rules:
+            steps = []
+            layout = _flatten(rule.shape, steps)
+            compiled.append(CompiledRule(
+                rule.name, _tuple(rule.trigger), rule.requires, _tuple(rule.marker), rule.default, tuple(steps),
+                # 没有嵌套时直接tuple(results)
+                None if layout == tuple(range(len(steps))) else layout,
+            ))
+        return tuple(compiled)
+
+    phrase = _compile(phrase_rules)
+    return RuleSet(
+        _compile(clause_rules), phrase,
+        # 一个都没有时短语就是叶子, 不需要新建一帧
+        frozenset(dep for rule in phrase for dep in rule.trigger),
+    )
 
-    def __init__(self, sentence):
-        basic_dependency = stanza_parser(sentence)
-        self._construct_word_list(basic_dependency)
-        self._construct_dependency_tree(basic_dependency)
 
-        self.relation = self._extract_uniOIE()
+UNIOIE_RULES = compile_rules(CLAUSE_RULES, PHRASE_RULES)
 
-        for deprels in self.tree.values():
-            for index, deprel, used in deprels:
-                if not used:
-                    print(deprel)
 
+def _nest(layout, results):
+    return tuple(_nest(slot, results) if type(slot) is tuple else results[slot] for slot in layout)
 
-    def _construct_word_list(self, basic_dependency):
+class DepTree:
+
+    metrics = NULL_METRICS
+    rules = UNIOIE_RULES
+
+    def __init__(self, sentence, parsed=None, parser=None, metrics=None, rules=None):
+        # parsed: 一个句子的解析结果, 即 Sentence.to_dict() 或 CoNLL-U 文本
+        # parser: 解析后端, 默认第一次使用时才加载stanza
+        # metrics: 可选的统计(metrics.Metrics), 默认不统计
+        # rules: compile_rules()编译的规则表, 默认是UNIOIE_RULES
+        self.metrics = metrics = metrics or NULL_METRICS
+        if rules is not None:
+            self.rules = rules
+        if parsed is None:
+            with metrics.timer('parse'):
+                parsed = (parser or default_parser()).parse(sentence)
+        elif type(parsed) is str:
+            parsed = from_conllu(parsed)[0]
+
+        with metrics.timer('construct'):
+            self._construct_word_list(parsed)
+            self._construct_dependency_tree(parsed)
+
+        with metrics.timer('walk'):
+            self.relation = self._extract_uniOIE()
+
+        if metrics:
+            metrics.count('sentences')
+            metrics.observe('sentence_length', len(parsed))
+            metrics.observe('recursion_depth', self.max_depth)
+            # 规则没有用到的依存关系
+            for children in self.edges.values():
+                for child, deprel in children:
+                    if not self.consumed[child]:
+                        metrics.count('unconsumed_deprel', deprel=deprel)
+
+    def _fired(self, walker, rule):
+        if self.metrics:
+            self.metrics.count('rule_fired', walker=walker, rule=rule)
+
+
+    def _construct_word_list(self, parsed):
         self.word_list = {'': Word('', '', 0)}
-        # print(basic_dependency.to_dict()[0])
-        for index, data in enumerate(basic_dependency.to_dict()[0], 1): 
+        # print(parsed)
+        for index, data in enumerate(parsed, 1): 
             word, pos_tag = data["text"], data["xpos"]
             if data["upos"] == "X":     # X means other, which can be regarded as a nominal
                 pos_tag = 'NN'
@@ -36,9 +156,14 @@ class DepTree:
         
             self.word_list[data['id']] = Word(word, pos_tag, index)
 
-    def _construct_dependency_tree(self, basic_dependency):
+    def _construct_dependency_tree(self, parsed):
+        # head -> deprel -> children, 每个桶按词序倒排, 末尾就是第一个可用的child
         self.tree = {}
-        for index, data in enumerate(basic_dependency.to_dict()[0], 1): 
+        # head -> [(child, deprel)], 按词序
+        self.edges = {}
+        # consumed[child]为1代表该关系已经被处理过
+        self.consumed = bytearray(len(parsed) + 1)
+        for index, data in enumerate(parsed, 1): 
             child, deprel = self.word_list[data["id"]], data["deprel"]
             deprel = deprel.split(':')[0]
 
@@ -47,149 +172,114 @@ class DepTree:
                 continue
             
             head = self.word_list[data['head']]
-            # True代表该关系没有被处理过
-            self.tree[head.index] = self.tree.get(head.index, []) + [[child.index, deprel, True]]
+            self.tree.setdefault(head.index, {}).setdefault(deprel, []).append(child.index)
+            self.edges.setdefault(head.index, []).append((child.index, deprel))
+
+        for buckets in self.tree.values():
+            for children in buckets.values():
+                children.reverse()
         
         # print(self.tree)
 
     def _extract_uniOIE(self):
-        relation_id = self._parse_clause(self.root)
-        # print(relation_id)
-
-        def _relation_id_to_text(rel):
-            return [_relation_id_to_text(ele)
-                    if type(ele) is tuple else 
-                    (ele if type(ele) is str else self.word_list[ele].text)
-                    for ele in rel]
-
-        relation = _relation_id_to_text(relation_id)
-        # print(relation)
-
-        return relation
-
-    def _parse_clause(self, node):
-        # 并列的clause
-        if (
-            self._has_dep(node, 'conj') and 
-            self._has_dep(self._has_dep(node, 'conj'), 'nsubj')
-        ):
-                conj_node = self._get_child(node, 'conj')
-                rel = self._get_child(conj_node, ['cc'])
-                rel = '@conj' if not rel else rel
-                print(self.tree)
-                return (
-                    self._parse_clause(node), 
-                    rel,
-                    self._parse_clause(conj_node),
-                )
-
-        # SVC
-        if (cop_node := self._get_child(node, 'cop')):
-            return (
-                self._parse_phrase(self._get_child(node, 'nsubj')), 
-                self._parse_phrase(cop_node),
-                self._parse_phrase(node),
-            )
-
-        if (comp_node := self._get_child(node, ['xcomp', 'ccomp'])):
-            rel = self._get_child(comp_node, ['case', 'mark'])
-            rel = '@cons' if not rel else rel
-
-            return (
-                self._parse_clause(node),
-                rel,
-                self._parse_clause(comp_node),
-            )
-
-        if (advcl_node := self._get_child(node, 'advcl')):
-            return (
-                self._parse_clause(node),
-                self._get_child(advcl_node, ['case', 'mark']),
-                self._parse_clause(advcl_node)
-            )
-
-        # SVOO
-        if (iobj_node := self._get_child(node, 'iobj')):
-            return ((
-                    self._parse_phrase(self._get_child(node, 'nsubj')),
-                    self._parse_phrase(node),
-                    self._parse_phrase(iobj_node)
-                ),
-                '@cons',
-                self._parse_phrase(self._get_child(node, 'obj')),
-            )
-        # I give an apple to her
-        # give -> obl -> her
-        if (obl_node := self._get_child(node, 'obl')):
-            return ((
-                    self._parse_phrase(self._get_child(node, 'nsubj')),
-                    self._parse_phrase(node),
-                    self._parse_phrase(self._get_child(node, 'obj'))
-                ),
-                self._get_child(obl_node, ['case', 'mark']),
-                self._parse_phrase(obl_node)
-            )
-
-        # SVO
-        if self._has_dep(node, 'obj'):
-            return (
-                self._parse_phrase(self._get_child(node, 'nsubj')),
-                self._parse_phrase(node),
-                self._parse_phrase(self._get_child(node, 'obj')),
-            )
-        # SV
-        else:
-            return (
-                self._parse_phrase(self._get_child(node, 'nsubj')),
-                self._parse_phrase(node),
-                '',
-            )
-
-    def _parse_phrase(self, node):
-        if (conj_node := self._get_child(node, 'conj')):
-            rel = self._get_child(conj_node, ['cc'])
-            rel = '@conj' if not rel else rel
-
-            return (
-                self._parse_phrase(node),
-                rel,
-                self._parse_phrase(conj_node),
-            )
-
-        if (mod_node := self._get_child(node, ['nummod', 'amod', 'det', 'advmod', 'compound', 'aux'])):
-            return (
-                self._parse_phrase(mod_node),
-                '@mod',
-                self._parse_phrase(node),
-            )
-
-        if (noun_mod_node := self._get_child(node, ['nmod'])):
-            rel = self._get_child(noun_mod_node, ['case'])
-            rel = '@mod' if not rel else rel
-
-            return (
-                self._parse_phrase(noun_mod_node),
-                rel,
-                self._parse_phrase(node),
-            )
-    
-        # 定语从句
-        if (acl_node := self._get_child(node, 'acl')):
-            rel = self._get_child(acl_node, 'case')
-            rel = '@cons' if not rel else rel
-
-            return (
-                self._parse_phrase(node),
-                rel,
-                self._parse_clause(acl_node)
-            )
+        return self._walk(self.root)
+
+    def _walk(self, root):
+        # 按CLAUSE_RULES/PHRASE_RULES的顺序匹配, 用显式的栈代替递归; 原来的递归实现在tests/test_walker.py里作为参照
+        # 每一帧结束时直接转换成Relation, 不需要再递归一遍_relation_id_to_text
+        rules = self.rules
+        stack = [self._apply(rules.clause, 'clause', root, self._available(root))]
+        max_depth = 1
+        result = None
+
+        while stack:
+            try:
+                kind, node = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                if type(result) is tuple:
+                    result = self._to_relation(result)
+                continue
 
-        if (appos_node := self._get_child(node, 'appos')):
-            return (
-                self._parse_phrase(node),
-                '@be',
-                self._parse_phrase(appos_node),
-            )
+            # 节点当前可用的依存关系只算一次
+            available = self._available(node)
+            if kind is PHRASE:
+                # 叶子节点不用新建一帧
+                if available.isdisjoint(rules.phrase_deprels):
+                    result = node
+                    if len(stack) >= max_depth:
+                        max_depth = len(stack) + 1
+                    continue
+                stack.append(self._apply(rules.phrase, 'phrase', node, available))
+            else:
+                stack.append(self._apply(rules.clause, 'clause', node, available))
+            result = None
+            if len(stack) > max_depth:
+                max_depth = len(stack)
+
+        # 与递归版本的递归深度相同
+        self.max_depth = max_depth
+        return result
+
+    def _to_relation(self, rel):
+        elements, ids = [], []
+        for ele in rel:
+            if type(ele) is tuple:
+                # SVOO/obl规则里的 (nsubj, verb, obj)
+                ele = self._to_relation(ele)
+            if type(ele) is Relation or type(ele) is str:
+                elements.append(ele)
+                ids.append(0)
+            else:
+                word = self.word_list[ele]
+                elements.append(word.text)
+                ids.append(word.index)
+        return Relation(*elements, ids=ids)
+
+    def _available(self, node):
+        buckets = self.tree.get(node)
+        if not buckets:
+            return frozenset()
+        return {dep for dep, children in buckets.items() if children}
+
+    def _apply(self, rules, walker, node, available):
+        # 按顺序找第一条命中的规则
+        for rule in rules:
+            if rule.trigger:
+                if available.isdisjoint(rule.trigger):
+                    continue
+                if rule.requires and not self._has_dep(self._has_dep(node, rule.trigger), rule.requires):
+                    continue
+                trigger = self._get_child(node, rule.trigger)
+            else:
+                trigger = ''
+
+            marker = rule.default
+            if rule.marker:
+                marker = self._get_child(trigger, rule.marker) or rule.default
+
+            self._fired(walker, rule.name)
+
+            results = []
+            for kind, source in rule.steps:
+                if kind is CONST:
+                    results.append(source)
+                elif kind is MARKER:
+                    results.append(marker)
+                else:
+                    if source is NODE:
+                        child = node
+                    elif source is TRIGGER:
+                        child = trigger
+                    else:
+                        # 到这个位置时才取, 与原来的求值顺序相同
+                        child = self._get_child(node, source)
+                    results.append((yield kind, child))
+
+            if rule.layout is None:
+                return tuple(results)
+            return _nest(rule.layout, results)
 
         return node
 
@@ -197,33 +287,100 @@ class DepTree:
         if type(deprels) is str:
             deprels = [deprels] 
 
-        for child, dep, available in self.tree.get(node, []):
-            if dep in deprels and available:
-                return child
+        buckets = self.tree.get(node)
+        if not buckets:
+            return 0
+
+        # 多个deprel时取词序最靠前的可用child
+        first = 0
+        for dep in deprels:
+            children = buckets.get(dep)
+            if children and (not first or children[-1] < first):
+                first = children[-1]
 
-        return 0
+        return first
 
     def _get_child(self, node, deprels):
         if type(deprels) is str:
             deprels = [deprels] 
-        # 只能获取一次
-        for index, (child, dep, available) in enumerate(self.tree.get(node, [])):
-            if available and dep in deprels:
-                self.tree[node][index][2] = False
-                return child
 
-        return ''
+        buckets = self.tree.get(node)
+        if not buckets:
+            return ''
+
+        first = None
+        for dep in deprels:
+            children = buckets.get(dep)
+            if children and (first is None or children[-1] < first[-1]):
+                first = children
+        if first is None:
+            return ''
+
+        # 只能获取一次
+        child = first.pop()
+        self.consumed[child] = 1
+        return child
 
 
 # 输入一个句子，输出一棵树
 # 根据依赖关系的算法
-def convert_UniOIE(sentence: str):
+def convert_UniOIE(sentence: str, parser=None):
     # 把句子转换为dependency
-    relation = DepTree(sentence).relation
+    relation = DepTree(sentence, parser=parser).relation
 
     return relation
 
 
+# 一次把多个句子送进解析器, 每个句子单独建树
+def convert_UniOIE_batch(sentences, batch_size=64, parser=None, metrics=None):
+    return [relation for _, relation in iter_uniOIE(sentences, batch_size=batch_size, parser=parser, metrics=metrics)]
+
+
+def _iter_lines(source):
+    # Path按行惰性读取, 与 read_text().split('\n') 得到的行相同; str是文本本身, 按行切分
+    if isinstance(source, Path):
+        with open(source, encoding='utf-8', newline='') as f:
+            for line in f:
+                yield line[:-1] if line.endswith('\n') else line
+    elif isinstance(source, str):
+        yield from source.split('\n')
+    else:
+        yield from source
+
+
+def iter_uniOIE(source, batch_size=64, parser=None, start=1, metrics=None):
+    """逐个yield (index, relation)
+
+    source 是文件的Path, 多行文本的str或者任意句子的可迭代对象, 按batch_size读取和解析,
+    调用方不取下一个结果时不会继续读入, 内存只与batch_size有关
+    空行不解析, relation为[], 与 outputs/*.output 里没有结果的句子相同
+    """
+    parser = parser or default_parser()
+    metrics = metrics or NULL_METRICS
+
+    batch = []
+    for index, sentence in enumerate(_iter_lines(source), start):
+        batch.append((index, sentence))
+        if len(batch) == batch_size:
+            yield from _extract_batch(batch, parser, metrics)
+            batch = []
+
+    if batch:
+        yield from _extract_batch(batch, parser, metrics)
+
+
+def _extract_batch(batch, parser, metrics=NULL_METRICS):
+    # 空行解析不出句子, 不送进解析器, 否则整个batch都会失败
+    sentences = [sentence for _, sentence in batch if sentence.strip()]
+    with metrics.timer('parse'):
+        parsed = iter(parser.parse_batch(sentences) if sentences else [])
+    for index, sentence in batch:
+        if not sentence.strip():
+            yield index, []
+            continue
+        yield index, DepTree(sentence, next(parsed), metrics=metrics).relation
+
+
 def test():
     # SV
     assert (
@@ -296,13 +453,106 @@ def test():
 
 
 if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--workers', type=int, default=1, help='进程数, 1为串行')
+    arg_parser.add_argument('--threads', type=int, default=1, help='每个worker的torch线程数')
+    arg_parser.add_argument('--resume', action='store_true', help='接着已有的jsonl抽取, 规则或解析配置变了时不要用')
+    arg_parser.add_argument('--incremental', action='store_true', help='只重新抽取输入/解析/规则变化了的句子')
+    arg_parser.add_argument('--metrics', default=None, help='把统计写到这个文件, .prom结尾时用Prometheus格式')
+    arg_parser.add_argument('--profile', choices=list(PROFILES), default=None, help='解析配置, 见backend.PROFILES')
+    arg_parser.add_argument('--token-budget', type=int, default=4096, help='每批解析的 最长句子词数 x 句子数 上限, 0为不分组')
+    arg_parser.add_argument('--index', default=None, help='同时把新抽取的关系追加到这个倒排索引, 见relation_index.py')
+    args = arg_parser.parse_args()
+
+    metrics = Metrics() if args.metrics else NULL_METRICS
+
     output_file = Path('outputs/uniOIE.output')
+    jsonl_file = Path('outputs/uniOIE.jsonl')
+
+    sentences = (Path(__file__).parent / 'all.txt').read_text().split('\n')
+    cache_path = Path(__file__).parent / '.cache/parse.sqlite'
+
+    if args.incremental:
+        from incremental import update
+
+        relation_index = None
+        if args.index:
+            from relation_index import RelationIndex
+
+            relation_index = RelationIndex(args.index)
+
+        changed = update(
+            sentences, output_file, Path('outputs/uniOIE.manifest.json'),
+            CachedParser(profile_parser(args.profile), ParseCache(cache_path)), jsonl_file=jsonl_file,
+            relation_index=relation_index,
+        )
+        print(f'{len(changed)} sentences re-extracted')
+        exit()
+
+    # 默认从头抽取; --resume时只抽取还没有写进jsonl的句子
+    written = written_indices(jsonl_file) if args.resume else set()
+    missing = [(index, sentence) for index, sentence in enumerate(sentences, 1) if index not in written]
+
+    relation_index, pending = None, []
+    if args.index:
+        from relation_index import RelationIndex
+
+        relation_index = RelationIndex(args.index)
+        if not args.resume:
+            relation_index.clear()
+        elif jsonl_file.exists():
+            # 索引是攒够一批才写的, 中断时jsonl里可能有还没进索引的句子, 先补上
+            relation_index.add_many(
+                (index, relation) for index, relation in dict(read_jsonl(jsonl_file)).items()
+                if index not in relation_index
+            )
+
+    def write(index, relation):
+        writer.write(index, relation)
+        if relation_index is None:
+            return
+        # 中断后接着跑时, 已经索引过的句子跳过
+        if index not in relation_index:
+            pending.append((index, relation))
+        if len(pending) >= 256:
+            relation_index.add_many(pending)
+            pending.clear()
+
+    with JsonlWriter(jsonl_file, resume=args.resume) as writer:
+        if args.workers > 1:
+            from parallel import iter_parallel
+
+            # 每个shard完成时就写入, 中断时只丢失还没完成的shard
+            relations = iter_parallel(
+                missing, workers=args.workers, threads=args.threads, cache_path=cache_path,
+                metrics=metrics, token_budget=args.token_budget,
+                # worker的线程数由--threads决定
+                parser_kwargs=dict(PROFILES[args.profile], threads=args.threads) if args.profile else None,
+            )
+            for index, relation in relations:
+                write(index, relation)
+        else:
+            # 修改规则后重跑时, 解析结果直接从缓存读取
+            parser = profile_parser(args.profile)
+            if args.token_budget:
+                # 一次读入256句, 按长度分组解析后再按原来的顺序输出
+                parser = BucketedParser(parser, args.token_budget)
+            parser = CachedParser(parser, ParseCache(cache_path))
+
+            relations = iter_uniOIE(
+                [sentence for _, sentence in missing], batch_size=256 if args.token_budget else 64, parser=parser,
+                start=0, metrics=metrics,
+            )
+            for position, relation in tqdm(relations, total=len(missing)):
+                with metrics.timer('serialize'):
+                    write(missing[position][0], relation)
 
-    all_relations = {}
-    for index, sentence in enumerate(tqdm((Path(__file__).parent / 'all.txt').read_text().split('\n')), 1):
-        relation = DepTree(sentence).relation
+    if pending:
+        relation_index.add_many(pending)
 
-        all_relations[index] = relation
+    export_output(jsonl_file, output_file)
 
-        output_file.write_text(json.dumps(all_relations, indent=2))
-    
+    if args.metrics:
+        Path(args.metrics).write_text(metrics.to_prometheus() if args.metrics.endswith('.prom') else metrics.to_json())
@@ -0,0 +1,127 @@
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# 可选的统计: 各阶段耗时, 规则命中次数, 未处理的deprel, 句子长度/递归深度的直方图
+# 不需要统计时用NULL_METRICS, 所有调用都是空操作
+
+BUCKETS = {
+    'sentence_length': [5, 10, 20, 40, 80, 160],
+    'recursion_depth': [2, 4, 8, 16, 32, 64],
+}
+
+
+class Metrics:
+
+    def __init__(self):
+        # (name, labels) -> 值, labels是排好序的 ((key, value), ...)
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def __bool__(self):
+        return True
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            count, total = self.timers.get(stage, (0, 0.0))
+            self.timers[stage] = (count + 1, total + time.perf_counter() - start)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value):
+        buckets = BUCKETS[name]
+        if name not in self.histograms:
+            self.histograms[name] = {'counts': [0] * (len(buckets) + 1), 'sum': 0, 'count': 0}
+        histogram = self.histograms[name]
+        histogram['counts'][bisect_left(buckets, value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+    def to_dict(self):
+        return {
+            'timers': {stage: {'count': count, 'seconds': total} for stage, (count, total) in self.timers.items()},
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            'histograms': {
+                name: dict(histogram, buckets=BUCKETS[name]) for name, histogram in self.histograms.items()
+            },
+        }
+
+    def merge(self, other):
+        # 合并其他进程的统计, other是Metrics或to_dict()的结果
+        other = other.to_dict() if isinstance(other, Metrics) else other
+        for stage, timer in other['timers'].items():
+            count, total = self.timers.get(stage, (0, 0.0))
+            self.timers[stage] = (count + timer['count'], total + timer['seconds'])
+        for counter in other['counters']:
+            self.count(counter['name'], counter['value'], **counter['labels'])
+        for name, histogram in other['histograms'].items():
+            mine = self.histograms.setdefault(name, {'counts': [0] * (len(BUCKETS[name]) + 1), 'sum': 0, 'count': 0})
+            mine['counts'] = [a + b for a, b in zip(mine['counts'], histogram['counts'])]
+            mine['sum'] += histogram['sum']
+            mine['count'] += histogram['count']
+        return self
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix='uniOIE'):
+        lines = []
+
+        lines.append(f'# TYPE {prefix}_stage_seconds_total counter')
+        for stage, (count, total) in self.timers.items():
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {total}')
+        lines.append(f'# TYPE {prefix}_stage_calls_total counter')
+        for stage, (count, total) in self.timers.items():
+            lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {count}')
+
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append(f'{prefix}_{name}_total{_labels(labels)} {value}')
+
+        for name, histogram in self.histograms.items():
+            lines.append(f'# TYPE {prefix}_{name} histogram')
+            cumulative = 0
+            for bound, count in zip(BUCKETS[name] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_sum {histogram["sum"]}')
+            lines.append(f'{prefix}_{name}_count {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class NullMetrics:
+
+    def __bool__(self):
+        return False
+
+    def timer(self, stage):
+        return nullcontext()
+
+    def count(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from backend import BucketedParser, StanzaParser, estimate_tokens
+from cache import CachedParser, ParseCache
+from main import convert_UniOIE_batch
+from metrics import Metrics
+
+# 每个worker进程自己的解析器, 在initializer里创建一次
+_parser = None
+
+
+def _init_worker(threads, parser_kwargs, cache_path, token_budget=None):
+    global _parser
+    # 限制每个worker的线程数, 避免多个torch进程抢占同一批CPU核
+    for name in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        os.environ[name] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    _parser = StanzaParser(**parser_kwargs)
+    if token_budget:
+        _parser = BucketedParser(_parser, token_budget)
+    if cache_path is not None:
+        _parser = CachedParser(_parser, ParseCache(cache_path))
+
+
+def _extract_shard(shard, collect_metrics=False):
+    indices, sentences = zip(*shard)
+    metrics = Metrics() if collect_metrics else None
+    relations = convert_UniOIE_batch(sentences, batch_size=len(sentences), parser=_parser, metrics=metrics)
+    return list(zip(indices, relations)), metrics and metrics.to_dict()
+
+
+def iter_parallel(
+    items, workers=None, threads=1, shard_size=64, parser_kwargs=None, cache_path=None, metrics=None,
+    token_budget=None,
+):
+    """items是 (index, sentence), 把它们切成shard分给多个进程, 每个shard完成时就yield它的 (index, relation)
+
+    结果按shard完成的顺序, 不是按index排序
+    token_budget: 先按估计的词数排序再切shard, worker内再用BucketedParser按词数分批
+    """
+    workers = workers or os.cpu_count()
+    parser_kwargs = {'use_gpu': False} if parser_kwargs is None else parser_kwargs
+
+    items = list(items)
+    if token_budget:
+        items.sort(key=lambda item: estimate_tokens(item[1]))
+    shards = [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+
+    # spawn: 子进程里重新import torch, 线程数设置才会生效
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(threads, parser_kwargs, cache_path, token_budget),
+    ) as pool:
+        futures = [pool.submit(_extract_shard, shard, bool(metrics)) for shard in shards]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='shards'):
+            shard, shard_metrics = future.result()
+            # 各个worker的统计汇总到metrics
+            if shard_metrics:
+                metrics.merge(shard_metrics)
+            yield from shard
+
+
+def extract_parallel(sentences, workers=None, threads=1, shard_size=64, parser_kwargs=None, cache_path=None, start=1, metrics=None, token_budget=None):
+    """返回与串行相同的 {index: relation}"""
+    results = dict(iter_parallel(
+        enumerate(sentences, start), workers, threads, shard_size, parser_kwargs, cache_path, metrics, token_budget,
+    ))
+    # 按index合并, 输出与串行一致
+    return {index: results[index] for index in sorted(results)}
@@ -0,0 +1,187 @@
+import json
+import sys
+from json.decoder import scanstring
+
+
+class Relation:
+    """不可变的 (subject, predicate, object) 节点
+
+    元素是intern过的字符串或者嵌套的Relation, ids记录三个字符串元素在句子中的词序号,
+    标记(@mod, to, ...)和空元素为0
+    """
+
+    __slots__ = ('subject', 'predicate', 'object', 'ids')
+
+    def __init__(self, subject, predicate, object, ids=(0, 0, 0)):
+        set_ = super().__setattr__
+        set_('subject', sys.intern(subject) if type(subject) is str else subject)
+        set_('predicate', sys.intern(predicate) if type(predicate) is str else predicate)
+        set_('object', sys.intern(object) if type(object) is str else object)
+        set_('ids', tuple(ids))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Relation is immutable')
+
+    def __reduce__(self):
+        # pickle按嵌套层数递归, 很深的relation展开成先序的节点列表再传
+        return _from_nodes, (tuple((*node, ids) for node, ids in zip(_nodes(self), _ids(self))),)
+
+    def __iter__(self):
+        yield self.subject
+        yield self.predicate
+        yield self.object
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        return (self.subject, self.predicate, self.object)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (Relation, list, tuple)):
+            return list(_nodes(self)) == list(_nodes(other))
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(_nodes(self)))
+
+    def __str__(self):
+        # 所有字符串元素按顺序用空格连接, 与逐层 f'{s} {p} {o}' 相同
+        words, stack = [], [self]
+        while stack:
+            element = stack.pop()
+            if type(element) is Relation:
+                stack.extend((element.object, element.predicate, element.subject))
+            else:
+                words.append(element)
+        return ' '.join(words)
+
+    def __repr__(self):
+        return f'Relation{tuple(self)!r}'
+
+    @property
+    def span(self):
+        # 子树覆盖的词序号范围, 没有词时为None
+        ids = [index for index in self.token_ids() if index]
+        return (min(ids), max(ids)) if ids else None
+
+    # conj链可以有几千层, 下面都用显式的栈, 不递归
+
+    def token_ids(self):
+        stack = [(self, 0)]
+        while stack:
+            node, index = stack.pop()
+            if type(node) is Relation:
+                stack.extend(zip(reversed(node), reversed(node.ids)))
+            else:
+                yield index
+
+    def to_list(self):
+        return _convert(self, list, lambda element: type(element) is Relation)
+
+    @classmethod
+    def from_list(cls, relation):
+        return _convert(relation, lambda elements: cls(*elements), lambda element: type(element) is not str)
+
+
+def _convert(root, build, is_node):
+    # 后序遍历, 子节点都转换完之后再用build构造父节点
+    stack, done = [(root, False)], []
+    while stack:
+        node, expanded = stack.pop()
+        if not is_node(node):
+            done.append(node)
+        elif expanded:
+            elements = done[len(done) - len(node):]
+            del done[len(done) - len(node):]
+            done.append(build(elements))
+        else:
+            stack.append((node, True))
+            stack.extend((element, False) for element in reversed(node))
+    return done[0]
+
+
+def _nodes(relation):
+    # 先序遍历, 每个节点给出一个tuple, 子节点用None占位; 用于比较和hash
+    stack = [relation]
+    while stack:
+        node = stack.pop()
+        yield tuple(element if type(element) is str else None for element in node)
+        stack.extend(element for element in reversed(node) if type(element) is not str)
+
+
+def _ids(relation):
+    # 与_nodes相同的先序, 每个节点的ids
+    stack = [relation]
+    while stack:
+        node = stack.pop()
+        yield node.ids
+        stack.extend(element for element in reversed(node) if type(element) is not str)
+
+
+def _from_nodes(nodes):
+    # __reduce__的逆过程: 倒序处理先序列表时, 子节点总是先于父节点构造好
+    done = []
+    for *elements, ids in reversed(nodes):
+        done.append(Relation(*(done.pop() if element is None else element for element in elements), ids=ids))
+    return done[0]
+
+
+def dumps(relation, indent=None, level=0, ensure_ascii=True):
+    """与 json.dumps(relation, indent=indent, default=to_json) 的结果相同, 但不递归
+
+    level: 在外层容器里的缩进层数
+    """
+    parts = []
+    # 栈里的str原样输出, (元素, 层数)是还没有序列化的元素
+    stack = [(relation, level)]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            parts.append(item)
+            continue
+        element, depth = item
+        if type(element) is str:
+            parts.append(json.dumps(element, ensure_ascii=ensure_ascii))
+            continue
+        if len(element) == 0:
+            parts.append('[]')
+            continue
+        if indent is None:
+            open_, separator, close = '[', ', ', ']'
+        else:
+            separator = ',\n' + ' ' * (indent * (depth + 1))
+            open_, close = '[' + separator[1:], '\n' + ' ' * (indent * depth) + ']'
+        stack.append(close)
+        for position in reversed(range(len(element))):
+            stack.append((element[position], depth + 1))
+            stack.append(separator if position else open_)
+    return ''.join(parts)
+
+
+def loads(text):
+    """dumps的逆过程, 只支持字符串组成的嵌套list"""
+    stack, position = [[]], 0
+    while position < len(text):
+        char = text[position]
+        if char == '"':
+            value, position = scanstring(text, position + 1)
+            stack[-1].append(value)
+            continue
+        if char == '[':
+            stack.append([])
+        elif char == ']':
+            value = stack.pop()
+            stack[-1].append(value)
+        elif char not in ', \n\r\t':
+            raise ValueError(f'unexpected {char!r} at {position}')
+        position += 1
+    (value,) = stack[0]
+    return value
+
+
+def to_json(obj):
+    # 用作 json.dumps(default=to_json)
+    if type(obj) is Relation:
+        return obj.to_list()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
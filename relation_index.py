@@ -0,0 +1,272 @@
+import argparse
+import json
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+
+from eval import _normalize, generate_all_triplets
+from relation import Relation
+
+# 关系的倒排索引: (字段, 词) -> [(句子index, 节点序号), ...]
+# 每个句子的关系按 generate_all_triplets 的先序展开, 节点序号就是在其中的位置,
+# 字段是 subject / predicate / object, 词是 _normalize 之后按空格切开的词
+# posting list 按 (句子, 节点) 排序后做差分 + varint 压缩, 新句子直接追加到末尾
+
+FIELDS = ('subject', 'predicate', 'object')
+
+Posting = namedtuple('Posting', ['sentence', 'node'])
+# path: 从根到这个子树经过的元素, 's'/'p'/'o', 根为''
+Hit = namedtuple('Hit', ['sentence', 'node', 'path', 'subject', 'predicate', 'object'])
+
+
+def _write_varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_postings(postings, previous=(0, 0)):
+    """postings按(句子, 节点)升序, 且都在previous之后; 同一个句子内节点只记差值"""
+    out = bytearray()
+    last_sentence, last_node = previous
+    for sentence, node in postings:
+        _write_varint(sentence - last_sentence, out)
+        _write_varint(node - last_node if sentence == last_sentence else node, out)
+        last_sentence, last_node = sentence, node
+    return bytes(out)
+
+
+def decode_postings(data):
+    postings = []
+    sentence = node = 0
+    value = shift = 0
+    first = True
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if first:
+            delta = value
+        else:
+            node = node + value if delta == 0 else value
+            sentence += delta
+            postings.append(Posting(sentence, node))
+        first = not first
+        value = shift = 0
+    return postings
+
+
+def _paths(relation):
+    # 与 eval._preorder 相同的先序, 同时记录每个节点的路径
+    paths, stack = [], [(relation, '')]
+    while stack:
+        node, path = stack.pop()
+        paths.append(path)
+        stack.extend(
+            (element, path + role)
+            for element, role in ((node.object, 'o'), (node.predicate, 'p'), (node.subject, 's'))
+            if type(element) is Relation
+        )
+    return paths
+
+
+def _tokens(text):
+    return _normalize(text).split()
+
+
+def _contains(words, phrase):
+    return any(words[start:start + len(phrase)] == phrase for start in range(len(words) - len(phrase) + 1))
+
+
+class RelationIndex:
+    """sqlite上的倒排索引, 查询时解码过的posting list缓存在内存里"""
+
+    def __init__(self, path='outputs/uniOIE.index.sqlite'):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS postings (field TEXT, token TEXT, data BLOB, count INTEGER, '
+            'last_sentence INTEGER, last_node INTEGER, PRIMARY KEY (field, token)) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS nodes (sentence INTEGER, node INTEGER, path TEXT, '
+            'subject TEXT, predicate TEXT, object TEXT, PRIMARY KEY (sentence, node)) WITHOUT ROWID'
+        )
+        self._postings = {}
+
+    def __contains__(self, sentence):
+        return self.connection.execute('SELECT 1 FROM nodes WHERE sentence = ? LIMIT 1', (sentence,)).fetchone() is not None
+
+    def add(self, sentence, relation):
+        self.add_many([(sentence, relation)])
+
+    def add_many(self, items):
+        """追加新抽取的句子, items是 (index, relation), relation也可以是json里的嵌套list"""
+        terms, rows = {}, []
+        for sentence, relation in items:
+            if relation == []:
+                continue
+            if type(relation) is not Relation:
+                relation = Relation.from_list(relation)
+            for node, (path, triplet) in enumerate(zip(_paths(relation), generate_all_triplets(relation))):
+                rows.append((sentence, node, path, *triplet))
+                for field, text in zip(FIELDS, triplet):
+                    for token in set(_tokens(text)):
+                        terms.setdefault((field, token), []).append((sentence, node))
+        if not rows:
+            return
+
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.executemany('INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)', rows)
+            except sqlite3.IntegrityError:
+                raise ValueError('sentence is already indexed') from None
+
+            for (field, token), postings in terms.items():
+                postings.sort()
+                row = self.connection.execute(
+                    'SELECT data, count, last_sentence, last_node FROM postings WHERE field = ? AND token = ?',
+                    (field, token),
+                ).fetchone()
+                if row is None:
+                    data, count, last = encode_postings(postings), len(postings), postings[-1]
+                elif postings[0] > (row[2], row[3]):
+                    # 新句子在已有的句子之后, 直接追加
+                    data, count, last = row[0] + encode_postings(postings, (row[2], row[3])), row[1] + len(postings), postings[-1]
+                else:
+                    merged = sorted(decode_postings(row[0]) + postings)
+                    data, count, last = encode_postings(merged), len(merged), merged[-1]
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO postings VALUES (?, ?, ?, ?, ?, ?)', (field, token, data, count, *last),
+                )
+                self._postings.pop((field, token), None)
+
+    def remove_many(self, sentences):
+        """删掉这些句子的节点和posting, 句子重新抽取之后先删再add_many"""
+        sentences = sorted(set(sentences))
+        if not sentences:
+            return
+
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            terms = set()
+            for sentence in sentences:
+                rows = self.connection.execute(
+                    'SELECT subject, predicate, object FROM nodes WHERE sentence = ?', (sentence,),
+                )
+                for triplet in rows:
+                    terms.update((field, token) for field, text in zip(FIELDS, triplet) for token in _tokens(text))
+            removed = set(sentences)
+
+            for field, token in terms:
+                row = self.connection.execute(
+                    'SELECT data FROM postings WHERE field = ? AND token = ?', (field, token),
+                ).fetchone()
+                if row is None:
+                    continue
+                kept = [posting for posting in decode_postings(row[0]) if posting.sentence not in removed]
+                if kept:
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO postings VALUES (?, ?, ?, ?, ?, ?)',
+                        (field, token, encode_postings(kept), len(kept), *kept[-1]),
+                    )
+                else:
+                    self.connection.execute('DELETE FROM postings WHERE field = ? AND token = ?', (field, token))
+                self._postings.pop((field, token), None)
+
+            self.connection.executemany('DELETE FROM nodes WHERE sentence = ?', [(sentence,) for sentence in sentences])
+
+    def replace_many(self, items):
+        """重新索引已经索引过的句子, items同add_many"""
+        items = list(items)
+        self.remove_many(sentence for sentence, _ in items)
+        self.add_many(items)
+
+    def postings(self, field, token):
+        key = (field, token)
+        if key not in self._postings:
+            row = self.connection.execute(
+                'SELECT data FROM postings WHERE field = ? AND token = ?', key,
+            ).fetchone()
+            self._postings[key] = decode_postings(row[0]) if row else []
+        return self._postings[key]
+
+    def search(self, subject=None, predicate=None, object=None, phrase=False):
+        """所有给出的字段的所有词都出现的节点(AND), 按(句子, 节点)排序
+
+        phrase=True 时每个字段的词还要在该字段里连续出现
+        """
+        query = {field: _tokens(text) for field, text in zip(FIELDS, (subject, predicate, object)) if text}
+        if not query:
+            return []
+
+        lists = sorted((self.postings(field, token) for field, tokens in query.items() for token in tokens), key=len)
+        if not lists[0]:
+            return []
+        candidates = set(lists[0])
+        for postings in lists[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+        candidates = sorted(candidates)
+
+        if not phrase:
+            return candidates
+        return [
+            Posting(hit.sentence, hit.node) for hit in self.resolve(candidates)
+            if all(_contains(_tokens(getattr(hit, field)), tokens) for field, tokens in query.items())
+        ]
+
+    def resolve(self, postings):
+        """[Hit], 带上路径和这个节点展开后的 (subject, predicate, object)"""
+        by_sentence = {}
+        for sentence, node in postings:
+            by_sentence.setdefault(sentence, []).append(node)
+
+        hits = {}
+        for sentence, nodes in by_sentence.items():
+            rows = self.connection.execute(
+                f'SELECT * FROM nodes WHERE sentence = ? AND node IN ({",".join("?" * len(nodes))})', (sentence, *nodes),
+            )
+            hits.update(((row[0], row[1]), Hit(*row)) for row in rows)
+        return [hits[posting] for posting in postings]
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM postings')
+            self.connection.execute('DELETE FROM nodes')
+        self._postings.clear()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--index', default='outputs/uniOIE.index.sqlite')
+    arg_parser.add_argument('--build', default=None, help='从 outputs/*.output 追加还没有索引的句子')
+    arg_parser.add_argument('--subject', default=None)
+    arg_parser.add_argument('--predicate', default=None)
+    arg_parser.add_argument('--object', default=None)
+    arg_parser.add_argument('--phrase', action='store_true')
+    args = arg_parser.parse_args()
+
+    with RelationIndex(args.index) as index:
+        if args.build:
+            relations = json.loads(Path(args.build).read_text())
+            index.add_many((int(key), relation) for key, relation in relations.items() if int(key) not in index)
+
+        postings = index.search(args.subject, args.predicate, args.object, phrase=args.phrase)
+        for hit in index.resolve(postings):
+            print(f'{hit.sentence}\t{hit.path or "-"}\t{hit.subject} | {hit.predicate} | {hit.object}')
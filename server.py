@@ -0,0 +1,171 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend import default_parser
+from main import DepTree
+from relation import to_json
+
+# 常驻的UniOIE抽取服务, pipeline只加载一次
+# 并发的请求先进入队列, 后台线程把它们合并成micro-batch一起解析
+#   POST /extract  {"sentence": "..."} 或 {"sentences": [...]}
+#   GET  /health
+
+
+class MicroBatcher:
+
+    def __init__(self, parser, max_batch=32, max_wait=0.01, max_queue=1024):
+        self.parser = parser
+        self.max_batch, self.max_wait = max_batch, max_wait
+        self.queue = queue.Queue(max_queue)
+        # 一个请求的句子要么全部入队, 要么都不入队
+        self._submit_lock = threading.Lock()
+        self.batches = self.sentences = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, sentence):
+        return self.submit_many([sentence])[0]
+
+    def submit_many(self, sentences):
+        # 队列剩余的位置不够时抛出queue.Full, 由调用方返回503; 比整个队列还长时抛出ValueError
+        if len(sentences) > self.queue.maxsize > 0:
+            raise ValueError(f'at most {self.queue.maxsize} sentences per request')
+        with self._submit_lock:
+            # 只有这里入队, 检查之后剩余的位置只会变多
+            if self.queue.maxsize > 0 and self.queue.maxsize - self.queue.qsize() < len(sentences):
+                raise queue.Full
+            futures = [Future() for _ in sentences]
+            for sentence, future in zip(sentences, futures):
+                self.queue.put_nowait((sentence, future))
+        return futures
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        # 第一个请求到达后最多再等max_wait, 凑够max_batch就立即处理
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                parsed = self.parser.parse_batch([sentence for sentence, _ in batch])
+            except Exception:
+                # batch里混着来自不同请求的句子, 整批解析失败时逐句重新解析, 错误只返回给出错的句子
+                parsed = None
+
+            for position, (sentence, future) in enumerate(batch):
+                # 一个句子的解析或规则出错不影响同一batch的其他句子
+                try:
+                    words = parsed[position] if parsed is not None else self.parser.parse(sentence)
+                    future.set_result(DepTree(sentence, words).relation)
+                except Exception as e:
+                    future.set_exception(e)
+
+            self.batches += 1
+            self.sentences += len(batch)
+
+
+class ExtractionServer(ThreadingHTTPServer):
+    # 并发连接多时默认的listen backlog(5)不够
+    request_queue_size = 128
+
+
+def make_server(batcher, host='localhost', port=8000, timeout=60):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            body = json.dumps(body, default=to_json).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/health':
+                self.send_error(404)
+                return
+            self._reply(200, {
+                'status': 'ok',
+                'queue': batcher.queue.qsize(),
+                'batches': batcher.batches,
+                'sentences': batcher.sentences,
+            })
+
+        def do_POST(self):
+            if self.path != '/extract':
+                self.send_error(404)
+                return
+
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                single = 'sentence' in request
+                sentences = [request['sentence']] if single else request['sentences']
+                # 字符串也是可迭代的, 不能当成逐个字符的句子列表
+                if type(sentences) is not list:
+                    raise TypeError
+            except (ValueError, KeyError, TypeError):
+                self._reply(400, {'error': 'expected {"sentence": ...} or {"sentences": [...]}'})
+                return
+
+            # 空句子解析不出结果, 不能让它进入和别的请求共用的batch
+            if not all(isinstance(sentence, str) and sentence.strip() for sentence in sentences):
+                self._reply(400, {'error': 'sentences must be non-empty strings'})
+                return
+
+            try:
+                futures = batcher.submit_many(sentences)
+            except ValueError as e:
+                self._reply(400, {'error': str(e)})
+                return
+            except queue.Full:
+                self._reply(503, {'error': 'queue is full'})
+                return
+
+            try:
+                relations = [future.result(timeout) for future in futures]
+            except Exception as e:
+                self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+                return
+
+            self._reply(200, {'relation': relations[0]} if single else {'relations': relations})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ExtractionServer((host, port), Handler)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--host', default='localhost')
+    arg_parser.add_argument('--port', type=int, default=8000)
+    arg_parser.add_argument('--max-batch', type=int, default=32)
+    arg_parser.add_argument('--max-wait', type=float, default=0.01, help='凑batch的最长等待时间(秒)')
+    arg_parser.add_argument('--max-queue', type=int, default=1024)
+    args = arg_parser.parse_args()
+
+    parser = default_parser()
+    # 启动时就加载模型, 第一个请求不用等
+    parser.parse('UniOIE is ready.')
+
+    batcher = MicroBatcher(parser, args.max_batch, args.max_wait, args.max_queue)
+    server = make_server(batcher, args.host, args.port)
+    print(f'UniOIE service on http://{args.host}:{args.port}/extract')
+    server.serve_forever()
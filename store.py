@@ -0,0 +1,199 @@
+"""关系树的紧凑二进制格式, 可以直接mmap读取
+
+字符串表 + 节点数组 + 每个句子的根节点区间:
+    strings    所有字符串的utf-8拼接, string_offsets[i]:string_offsets[i+1] 为第i个字符串
+    nodes      (N, 3) int32, subject/predicate/object 的引用
+    node_ids   (N, 3) int32, 对应元素在句子中的词序号
+    roots      int32, 所有句子的根引用依次排列
+    sentence_offsets[k]:sentence_offsets[k+1] 为第k个句子的根在roots中的区间
+引用 >= 0 为节点编号, < 0 为字符串编号 -ref - 1
+
+outputs/*.output 也用同样的格式保存(write_output_store), 每个系统一个文件,
+nest系统每个句子一个根关系, 其余系统每个句子若干个根关系, 可以精确还原成原来的json
+"""
+
+import json
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from relation import Relation
+
+
+MAGIC = b'UOIE'
+VERSION = 1
+ALIGN = 8
+
+
+class StoreBuilder:
+
+    def __init__(self):
+        self.strings = {}
+        self.nodes, self.node_ids = [], []
+        self.roots, self.sentence_offsets = [], [0]
+        self.keys, self.texts = [], []
+
+    def string(self, text):
+        if text not in self.strings:
+            self.strings[text] = len(self.strings)
+        return -self.strings[text] - 1
+
+    def ref(self, element):
+        # 后序: 子节点的编号总是小于父节点; conj链可以有几千层, 用显式的栈
+        stack, done = [(element, False)], []
+        while stack:
+            element, expanded = stack.pop()
+            if type(element) is str:
+                done.append(self.string(element))
+            elif expanded:
+                self.nodes.append(done[-3:])
+                del done[-3:]
+                self.node_ids.append(list(getattr(element, 'ids', (0, 0, 0))))
+                done.append(len(self.nodes) - 1)
+            else:
+                if len(element) != 3:
+                    raise ValueError(f'expected a (subject, predicate, object) relation, got {element!r}')
+                stack.append((element, True))
+                stack.extend((child, False) for child in reversed(element))
+        return done[0]
+
+    def add(self, key, roots, text=None):
+        self.keys.append(key)
+        self.texts.append(-1 if text is None else -self.string(text) - 1)
+        self.roots.extend(self.ref(root) for root in roots)
+        self.sentence_offsets.append(len(self.roots))
+
+    def write(self, path, metadata=None):
+        encoded = [text.encode('utf-8') for text in self.strings]
+        arrays = {
+            'strings': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'string_offsets': np.cumsum([0] + [len(text) for text in encoded], dtype=np.int64),
+            'nodes': np.array(self.nodes, dtype=np.int32).reshape(-1, 3),
+            'node_ids': np.array(self.node_ids, dtype=np.int32).reshape(-1, 3),
+            'roots': np.array(self.roots, dtype=np.int32),
+            'sentence_offsets': np.array(self.sentence_offsets, dtype=np.int64),
+            'keys': np.array(self.keys, dtype=np.int64),
+            'texts': np.array(self.texts, dtype=np.int32),
+        }
+
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': array.shape}
+            offset += _aligned(array.nbytes)
+
+        header = json.dumps({'version': VERSION, 'arrays': layout, 'metadata': metadata or {}}).encode()
+        start = _aligned(len(MAGIC) + 8 + len(header))
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, array in arrays.items():
+                f.seek(start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(start + offset)
+        tmp_path.replace(path)
+
+
+def _aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+class Store:
+    """mmap打开的关系树, 数组都是numpy视图, 只有访问时才解码"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a relation store')
+        header_len, = struct.unpack_from('<Q', self.buffer, len(MAGIC))
+        header = json.loads(self.buffer[len(MAGIC) + 8:len(MAGIC) + 8 + header_len])
+        if header['version'] != VERSION:
+            raise ValueError(f'{path} has store version {header["version"]}, expected {VERSION}')
+        self.metadata = header['metadata']
+
+        start = _aligned(len(MAGIC) + 8 + header_len)
+        for name, spec in header['arrays'].items():
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            count = int(np.prod(shape)) if shape else 1
+            array = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=start + spec['offset'])
+            setattr(self, name, array.reshape(shape))
+
+        self.position = {int(key): position for position, key in enumerate(self.keys)}
+        self._strings = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.position
+
+    def string(self, string_id):
+        if string_id not in self._strings:
+            start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+            self._strings[string_id] = bytes(self.strings[start:end]).decode('utf-8')
+        return self._strings[string_id]
+
+    def text(self, key):
+        string_id = self.texts[self.position[key]]
+        return None if string_id < 0 else self.string(int(string_id))
+
+    def root_refs(self, key):
+        position = self.position[key]
+        return self.roots[self.sentence_offsets[position]:self.sentence_offsets[position + 1]]
+
+    def _build(self, ref, build):
+        # 后序遍历引用, 三个子元素都解码之后再用build(节点编号, 子元素)构造父节点
+        stack, done = [(int(ref), False)], []
+        while stack:
+            ref, expanded = stack.pop()
+            if ref < 0:
+                done.append(self.string(-ref - 1))
+            elif expanded:
+                elements = done[-3:]
+                del done[-3:]
+                done.append(build(ref, elements))
+            else:
+                stack.append((ref, True))
+                stack.extend((child, False) for child in reversed(self.nodes[ref].tolist()))
+        return done[0]
+
+    def element(self, ref):
+        return self._build(ref, lambda ref, elements: Relation(*elements, ids=self.node_ids[ref].tolist()))
+
+    def relations(self, key):
+        return [self.element(ref) for ref in self.root_refs(key)]
+
+    def element_list(self, ref):
+        # 与element相同, 但返回json里的嵌套list
+        return self._build(ref, lambda ref, elements: elements)
+
+def write_output_store(relations, path, nest, metadata=None):
+    """把 outputs/*.output 的 {index: relations} 写成store
+
+    nest: 每个句子是一个嵌套的关系或者[], 否则是 [[s, p, o], ...]
+    """
+    builder = StoreBuilder()
+    for index, value in relations.items():
+        if str(int(index)) != index:
+            raise ValueError(f'output index {index!r} is not an integer')
+        if nest:
+            builder.add(int(index), [value] if value != [] else [])
+        else:
+            builder.add(int(index), value)
+    builder.write(path, metadata=dict(metadata or {}, nest=nest))
+
+
+def read_output_store(store):
+    """write_output_store的逆过程, json.dumps(..., indent=2)后与原来的文件相同"""
+    nest = store.metadata['nest']
+    relations = {}
+    for key in store.keys.tolist():
+        values = [store.element_list(ref) for ref in store.root_refs(key)]
+        relations[str(key)] = (values[0] if values else []) if nest else values
+    return relations
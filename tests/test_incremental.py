@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from backend import StubParser
+from incremental import update
+from jsonl import dump_output, load_output
+from relation import dumps
+
+ROOT = Path(__file__).parent.parent
+
+
+def _fingerprint(seed):
+    return subprocess.run(
+        [sys.executable, '-c', 'from incremental import rule_fingerprint; print(rule_fingerprint())'],
+        cwd=ROOT, env=dict(os.environ, PYTHONHASHSEED=str(seed)), capture_output=True, text=True, check=True,
+    ).stdout
+
+
+def test_rule_fingerprint_is_stable_across_processes():
+    # 每个进程的string hash seed不同, 规则没变时fingerprint也不能变
+    assert _fingerprint(1) == _fingerprint(2)
+
+
+def test_load_output_reads_deep_relations(tmp_path):
+    relation = 'x'
+    for index in range(1500):
+        relation = [relation, 'and', str(index)]
+    relations = {'1': relation, '2': [], '3': ['I', 'love', 'you']}
+    output_file = tmp_path / 'uniOIE.output'
+    output_file.write_text(dump_output(relations))
+
+    loaded = load_output(output_file)
+    assert {key: dumps(value) for key, value in loaded.items()} == {key: dumps(value) for key, value in relations.items()}
+
+
+def test_update_only_reextracts_changed_sentences(tmp_path):
+    output_file, manifest_file = tmp_path / 'uniOIE.output', tmp_path / 'manifest.json'
+    sentences = ['I love you', 'he ate an apple', 'she likes tea']
+
+    assert update(sentences, output_file, manifest_file, StubParser()) == [1, 2, 3]
+    assert update(sentences, output_file, manifest_file, StubParser()) == []
+    sentences[1] = 'he ate an orange'
+    assert update(sentences, output_file, manifest_file, StubParser()) == [2]
@@ -0,0 +1,29 @@
+from backend import StubParser
+from main import DepTree, iter_uniOIE
+
+
+class StrictParser(StubParser):
+    # 与stanza一样, 空的输入解析不出句子
+    def parse(self, sentence):
+        if not sentence.strip():
+            raise IndexError('list index out of range')
+        return super().parse(sentence)
+
+
+def test_blank_lines_keep_their_index():
+    sentences = ['I love you', '', '   ', 'he ate an apple']
+    results = list(iter_uniOIE(sentences, batch_size=3, parser=StrictParser()))
+
+    assert [index for index, _ in results] == [1, 2, 3, 4]
+    assert results[1][1] == [] and results[2][1] == []
+    assert results[3][1] == DepTree('he ate an apple', parser=StubParser()).relation
+
+
+def test_plain_string_is_text_not_a_path(tmp_path):
+    text = 'I love you\nhe ate an apple'
+    sentences_file = tmp_path / 'sentences.txt'
+    sentences_file.write_text(text)
+
+    from_text = list(iter_uniOIE(text, parser=StubParser()))
+    assert len(from_text) == 2
+    assert from_text == list(iter_uniOIE(sentences_file, parser=StubParser()))
@@ -0,0 +1,185 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from backend import StubParser
+from main import DepTree
+from relation import Relation
+
+# _walk按规则表用显式的栈遍历, 这里保留原来的递归实现作为参照,
+# 两者对同一棵依存树必须给出相同的relation和词序号
+
+ALL_TXT = Path(__file__).parent.parent / 'all.txt'
+
+
+class RecursiveDepTree(DepTree):
+
+    def __init__(self, words):
+        self._construct_word_list(words)
+        self._construct_dependency_tree(words)
+
+    def _extract_uniOIE_recursive(self):
+        relation_id = self._parse_clause(self.root)
+
+        def _relation_id_to_text(rel):
+            elements = [_relation_id_to_text(ele)
+                        if type(ele) is tuple else 
+                        (ele if type(ele) is str else self.word_list[ele].text)
+                        for ele in rel]
+            ids = [0 if type(ele) in (tuple, str) else self.word_list[ele].index for ele in rel]
+            return Relation(*elements, ids=ids)
+
+        relation = _relation_id_to_text(relation_id)
+
+        return relation
+
+    def _parse_clause(self, node):
+        # 并列的clause
+        if (
+            self._has_dep(node, 'conj') and 
+            self._has_dep(self._has_dep(node, 'conj'), 'nsubj')
+        ):
+                conj_node = self._get_child(node, 'conj')
+                rel = self._get_child(conj_node, ['cc'])
+                rel = '@conj' if not rel else rel
+                return (
+                    self._parse_clause(node), 
+                    rel,
+                    self._parse_clause(conj_node),
+                )
+
+        # SVC
+        if (cop_node := self._get_child(node, 'cop')):
+            return (
+                self._parse_phrase(self._get_child(node, 'nsubj')), 
+                self._parse_phrase(cop_node),
+                self._parse_phrase(node),
+            )
+
+        if (comp_node := self._get_child(node, ['xcomp', 'ccomp'])):
+            rel = self._get_child(comp_node, ['case', 'mark'])
+            rel = '@cons' if not rel else rel
+
+            return (
+                self._parse_clause(node),
+                rel,
+                self._parse_clause(comp_node),
+            )
+
+        if (advcl_node := self._get_child(node, 'advcl')):
+            return (
+                self._parse_clause(node),
+                self._get_child(advcl_node, ['case', 'mark']),
+                self._parse_clause(advcl_node)
+            )
+
+        # SVOO
+        if (iobj_node := self._get_child(node, 'iobj')):
+            return ((
+                    self._parse_phrase(self._get_child(node, 'nsubj')),
+                    self._parse_phrase(node),
+                    self._parse_phrase(iobj_node)
+                ),
+                '@cons',
+                self._parse_phrase(self._get_child(node, 'obj')),
+            )
+        # I give an apple to her
+        # give -> obl -> her
+        if (obl_node := self._get_child(node, 'obl')):
+            return ((
+                    self._parse_phrase(self._get_child(node, 'nsubj')),
+                    self._parse_phrase(node),
+                    self._parse_phrase(self._get_child(node, 'obj'))
+                ),
+                self._get_child(obl_node, ['case', 'mark']),
+                self._parse_phrase(obl_node)
+            )
+
+        # SVO
+        if self._has_dep(node, 'obj'):
+            return (
+                self._parse_phrase(self._get_child(node, 'nsubj')),
+                self._parse_phrase(node),
+                self._parse_phrase(self._get_child(node, 'obj')),
+            )
+        # SV
+        else:
+            return (
+                self._parse_phrase(self._get_child(node, 'nsubj')),
+                self._parse_phrase(node),
+                '',
+            )
+
+    def _parse_phrase(self, node):
+        if (conj_node := self._get_child(node, 'conj')):
+            rel = self._get_child(conj_node, ['cc'])
+            rel = '@conj' if not rel else rel
+
+            return (
+                self._parse_phrase(node),
+                rel,
+                self._parse_phrase(conj_node),
+            )
+
+        if (mod_node := self._get_child(node, ['nummod', 'amod', 'det', 'advmod', 'compound', 'aux'])):
+            return (
+                self._parse_phrase(mod_node),
+                '@mod',
+                self._parse_phrase(node),
+            )
+
+        if (noun_mod_node := self._get_child(node, ['nmod'])):
+            rel = self._get_child(noun_mod_node, ['case'])
+            rel = '@mod' if not rel else rel
+
+            return (
+                self._parse_phrase(noun_mod_node),
+                rel,
+                self._parse_phrase(node),
+            )
+    
+        # 定语从句
+        if (acl_node := self._get_child(node, 'acl')):
+            rel = self._get_child(acl_node, 'case')
+            rel = '@cons' if not rel else rel
+
+            return (
+                self._parse_phrase(node),
+                rel,
+                self._parse_clause(acl_node)
+            )
+
+        if (appos_node := self._get_child(node, 'appos')):
+            return (
+                self._parse_phrase(node),
+                '@be',
+                self._parse_phrase(appos_node),
+            )
+
+        return node
+
+
+def _assert_same(words):
+    relation = DepTree('', words).relation
+    # 规则会消耗子节点, 参照实现要用新建的树
+    expected = RecursiveDepTree(words)._extract_uniOIE_recursive()
+    assert relation.to_list() == expected.to_list()
+    assert list(relation.token_ids()) == list(expected.token_ids())
+
+
+def test_walker_matches_recursive_on_corpus():
+    sentences = [line for line in ALL_TXT.read_text().split('\n') if line.strip()]
+    for words in StubParser().parse_batch(sentences):
+        _assert_same(words)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_walker_matches_recursive_on_random_trees(seed):
+    rng = random.Random(seed)
+    vocabulary = ['I', 'love', 'you', 'and', 'the', 'big', 'apple', 'to', 'her', 'that', ',', '.']
+    parser = StubParser()
+    for _ in range(150):
+        # StubParser按句子内容生成确定的随机依存树
+        sentence = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 40)))
+        _assert_same(parser.parse(sentence))